@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of the lichess.org fishnet client.
+# Copyright (C) 2016 Niklas Fiekas <niklas.fiekas@backscattering.de>
+# See LICENSE.txt for licensing information.
+
+# Helper script to benchmark parts of the fishnet client.
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import collections
+import threading
+import time
+import os
+import sys
+import fishnet
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+
+# Engine that answers each go command with a flood of info lines
+MOCK_ENGINE = """
+import sys
+info = ("info depth 20 currmove e2e4 currmovenumber 1\\n"
+        "info depth 20 seldepth 30 multipv 1 score cp 24 nodes 1686023 "
+        "nps 1670251 tbhits 0 time 1004 pv e2e4 e7e5 g1f3 g8f6 b1c3 b8c6\\n")
+while True:
+    line = sys.stdin.readline()
+    if not line or line.startswith("quit"):
+        break
+    elif line.startswith("isready"):
+        sys.stdout.write("readyok\\n")
+        sys.stdout.flush()
+    elif line.startswith("go"):
+        n = int(line.split()[-1])
+        sys.stdout.write(info * n + "bestmove e2e4\\n")
+        sys.stdout.flush()
+"""
+
+
+def make_conf(args):
+    conf = configparser.ConfigParser()
+    conf.add_section("Fishnet")
+    conf.add_section("Stockfish")
+    if args.engine_dir:
+        conf.set("Fishnet", "EngineDir", args.engine_dir)
+    if args.stockfish_command:
+        conf.set("Fishnet", "StockfishCommand", args.stockfish_command)
+    return conf
+
+
+def bench_startup(args):
+    conf = make_conf(args)
+    command = fishnet.get_stockfish_command(conf, update=False)
+    engine_dir = fishnet.get_engine_dir(conf)
+
+    ready = collections.OrderedDict()
+    processes = []
+
+    def start_engine(i):
+        p = fishnet.open_process(command, engine_dir)
+        processes.append(p)
+        fishnet.uci(p)
+        fishnet.setoption(p, "Threads", args.threads)
+        fishnet.setoption(p, "Hash", args.hash)
+        fishnet.isready(p)
+        ready[i] = time.time() - start
+
+    start = time.time()
+    if args.serial:
+        for i in range(args.engines):
+            start_engine(i)
+    else:
+        threads = [threading.Thread(target=start_engine, args=(i, )) for i in range(args.engines)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for p in processes:
+        fishnet.kill_process(p)
+
+    times = sorted(ready.values())
+    print("%d engines (%d threads, %d MB hash), %s startup" % (
+        args.engines, args.threads, args.hash, "serial" if args.serial else "parallel"))
+    print("First engine ready: %0.3fs" % times[0])
+    print("Median engine ready: %0.3fs" % fishnet.percentile(times, 50))
+    print("All engines ready: %0.3fs" % times[-1])
+
+
+def bench_overhead(args):
+    conf = make_conf(args)
+    conf.set("Fishnet", "Key", "testkey")
+    settings = fishnet.load_settings(conf)
+
+    def timeit(f):
+        start = time.time()
+        for _ in range(args.iterations):
+            f()
+        return (time.time() - start) / args.iterations
+
+    # Per ply, the log prefix is formatted and a request may be made
+    def lookup_conf():
+        fishnet.base_url(fishnet.get_endpoint(conf))
+        fishnet.get_endpoint(conf, "analysis/12345678")
+        fishnet.get_key(conf)
+
+    def lookup_settings():
+        settings.base_url
+        settings.endpoint + "analysis/12345678"
+        settings.key
+
+    before = timeit(lookup_conf)
+    after = timeit(lookup_settings)
+    print("Config lookups per ply: %0.2f us" % (before * 1e6))
+    print("Settings lookups per ply: %0.2f us" % (after * 1e6))
+    print("Speedup: %0.1fx" % (before / after))
+
+
+def bench_recv(args):
+    devnull = open(os.devnull, "w")
+    fishnet.setup_logging(3 if args.trace else 0, devnull)
+
+    p = fishnet.open_process([sys.executable, "-c", MOCK_ENGINE], shell=False)
+
+    start = time.time()
+    if args.parse:
+        fishnet.go(p, "startpos", [], nodes=args.lines)
+    else:
+        # Progress updates about the current move can be skipped, like in go()
+        fishnet.send(p, "go nodes %d" % args.lines)
+        skip = fishnet.CURRMOVE if args.skip else None
+        while fishnet.recv(p, skip) != "bestmove e2e4":
+            pass
+    end = time.time()
+
+    fishnet.send(p, "quit")
+    p.wait()
+
+    if args.parse:
+        mode = "parsing with go()"
+    elif args.skip:
+        mode = "skipping currmove"
+    else:
+        mode = "decoding all"
+    print("Engine trace %s, %s: %d lines/s" % (
+        "enabled" if args.trace else "disabled", mode, 2 * args.lines / (end - start)))
+
+
+def bench_nps(args):
+    conf = make_conf(args)
+    command = fishnet.get_stockfish_command(conf, update=False)
+    engine_dir = fishnet.get_engine_dir(conf)
+
+    p = fishnet.open_process(command, engine_dir)
+    _, options = fishnet.uci(p)
+    fishnet.setoption(p, "Threads", args.threads)
+
+    large_pages = [False, True] if "Large Pages" in options else [False]
+    if len(large_pages) < 2:
+        print("Engine has no Large Pages option")
+
+    for hash_size in args.hash:
+        for large in large_pages:
+            if "Large Pages" in options:
+                fishnet.setoption(p, "Large Pages", large)
+            fishnet.setoption(p, "Hash", hash_size)
+            fishnet.send(p, "ucinewgame")
+            fishnet.isready(p)
+
+            info = fishnet.go(p, fishnet.BENCH_POSITION, [], movetime=args.movetime)
+            print("Hash %4d MB, large pages %-3s: %d nps" % (
+                hash_size, "yes" if large else "no", info.get("nps", 0)))
+
+    fishnet.send(p, "quit")
+    p.wait()
+
+
+def deep_getsizeof(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, seen) + deep_getsizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_getsizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_getsizeof(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+
+def bench_memory(args):
+    # Typical analysis of a ply, with a long principal variation
+    pv = "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6 c2c3 e8g8"
+    plies = []
+    for ply in range(args.plies):
+        plies.append({
+            "bestmove": "e2e4",
+            "depth": 20 + ply % 5,
+            "seldepth": 30 + ply % 7,
+            "multipv": 1,
+            "score": {"cp": ply * 7 % 300 - 150},
+            "nodes": 3500000 + ply,
+            "nps": 1670251 + ply,
+            "tbhits": 0,
+            "time": 2000 + ply,
+            "pv": " ".join(pv.split()[ply % 4:]),
+        })
+
+    compact = [fishnet.PlyInfo.from_info(part) for part in plies]
+
+    dict_size = deep_getsizeof(plies)
+    compact_size = deep_getsizeof(compact)
+    print("%d plies as dicts: %d KiB (%d bytes per ply)" % (
+        args.plies, dict_size / 1024, dict_size / args.plies))
+    print("%d plies as PlyInfo: %d KiB (%d bytes per ply)" % (
+        args.plies, compact_size / 1024, compact_size / args.plies))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="fishnet benchmarks")
+    parser.add_argument("--engine-dir", help="engine working directory")
+    parser.add_argument("--stockfish-command",
+                        help="stockfish command (default: previously downloaded Stockfish)")
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    p = subparsers.add_parser("startup", help="time until all engines are ready")
+    p.add_argument("--engines", type=int, default=fishnet.cpu_count())
+    p.add_argument("--threads", type=int, default=1)
+    p.add_argument("--hash", type=int, default=fishnet.HASH_DEFAULT)
+    p.add_argument("--serial", action="store_true", help="start engines one after another")
+    p.set_defaults(func=bench_startup)
+
+    p = subparsers.add_parser("overhead", help="per ply overhead of configuration lookups")
+    p.add_argument("--iterations", type=int, default=100000)
+    p.set_defaults(func=bench_overhead)
+
+    p = subparsers.add_parser("recv", help="lines per second received from a mock engine")
+    p.add_argument("--lines", type=int, default=1000000)
+    p.add_argument("--trace", action="store_true", help="log engine output (as with -vvv)")
+    p.add_argument("--skip", action="store_true", help="skip currmove lines without decoding")
+    p.add_argument("--parse", action="store_true", help="parse info lines with go()")
+    p.set_defaults(func=bench_recv)
+
+    p = subparsers.add_parser("nps", help="engine speed with different hash sizes and large pages")
+    p.add_argument("--threads", type=int, default=1)
+    p.add_argument("--hash", type=int, nargs="+",
+                   default=[fishnet.HASH_MIN, fishnet.HASH_DEFAULT, fishnet.HASH_MAX])
+    p.add_argument("--movetime", type=int, default=fishnet.BENCH_MOVETIME)
+    p.set_defaults(func=bench_nps)
+
+    p = subparsers.add_parser("memory", help="memory used by the analysis of a long game")
+    p.add_argument("--plies", type=int, default=300)
+    p.set_defaults(func=bench_memory)
+
+    args = parser.parse_args(argv[1:])
+    if not hasattr(args, "func"):
+        parser.print_help()
+        return 1
+
+    if args.func is not bench_recv:
+        fishnet.setup_logging(0)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -44,6 +44,15 @@ import signal
 import ctypes
 import string
 import socket
+import shlex
+import struct
+import gzip
+import array
+import email.utils
+import hashlib
+import hmac
+import calendar
+import shutil
 
 from distutils.version import LooseVersion
 
@@ -66,14 +75,14 @@ except ImportError:
     import urllib.parse as urlparse
 
 try:
-    import urllib.request as urllib
+    import configparser
 except ImportError:
-    import urllib
+    import ConfigParser as configparser
 
 try:
-    import configparser
+    import socketserver
 except ImportError:
-    import ConfigParser as configparser
+    import SocketServer as socketserver
 
 try:
     from shlex import quote as shell_quote
@@ -100,13 +109,44 @@ HASH_DEFAULT = 256
 HASH_MAX = 512
 MAX_BACKOFF = 30.0
 MAX_FIXED_BACKOFF = 3.0
+MIN_PRESSURE = 0.25
+MAX_PRESSURE = 8.0
 HTTP_TIMEOUT = 15.0
+PIPE_CHUNK = 65536
+
+# Progress updates about the move currently searched, like
+# info depth 20 currmove e2e4 currmovenumber 1
+CURRMOVE = re.compile(br"^info depth \d+ (?:seldepth \d+ )?currmove ")
+MAX_LONG_POLL = 60.0
 STAT_INTERVAL = 60.0
 DEFAULT_CONFIG = "fishnet.ini"
+STARTUP_CACHE = ".fishnet-cache.json"
+CGROUP_ROOT = "/sys/fs/cgroup"
+PROC_CGROUP = "/proc/self/cgroup"
+ARTIFACT_CACHE = ".fishnet-artifacts"
+RELEASE_CHECK_INTERVAL = 3600.0
+DOWNLOAD_CHUNK = 65536
+MAX_REDIRECTS = 5
 PROGRESS_REPORT_INTERVAL=3.0
 CHECK_PYPI_CHANCE = 0.01
 LVL_MOVETIMES = [50, 100, 150, 200, 300, 400, 500, 1000]
 LVL_DEPTHS = [1, 1, 2, 3, 5, 8, 13, 22]
+LIGHT_LEVEL = 7
+STARTPOS = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+BENCH_POSITION = "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+BENCH_MOVETIME = 1000
+MOVE_LATENCY_SAMPLES = 1000
+PONDER_MOVETIME = 2000
+CONTROL_INTERVAL = 30.0
+PRESSURE_HIGH = 25.0
+PRESSURE_LOW = 5.0
+ANALYSIS_DEFAULTS = {"nodes": 3500000, "movetime": 4000, "depth": None, "multipv": 1}
+MAX_MULTIPV = 16
+TABLEBASE_NODES = 100000
+COORDINATOR_PORT = 9670
+COORDINATOR_PATH = re.compile(r"^(acquire|(analysis|move|abort)/[a-zA-Z0-9]{1,32})$")
+COORDINATOR_WAIT = 10.0
+DEFAULT_BATCH = 4
 
 
 def intro():
@@ -124,6 +164,9 @@ def intro():
 """.lstrip() % __version__
 
 
+STARTUP = time.time()
+STARTUP_TIMINGS = collections.OrderedDict()
+
 PROGRESS = 15
 ENGINE = 5
 logging.addLevelName(PROGRESS, "PROGRESS")
@@ -131,9 +174,14 @@ logging.addLevelName(ENGINE, "ENGINE")
 
 
 class LogFormatter(logging.Formatter):
+    # Keywords (like the API key) to censor in the output
+    censored = set()
+
     def format(self, record):
         # Format message
         msg = super(LogFormatter, self).format(record)
+        for keyword in self.censored:
+            msg = msg.replace(keyword, "*" * len(keyword))
 
         # Add level name
         if record.levelno in [logging.INFO, PROGRESS]:
@@ -195,34 +243,19 @@ class TailLogHandler(logging.Handler):
                 self.target_handler.handle(record)
 
 
-class CensorLogFilter(logging.Filter):
-    def __init__(self, keyword):
-        self.keyword = keyword
-
-    def censor(self, msg):
-        try:
-            # Python 2
-            if not isinstance(msg, basestring):
-                return msg
-        except NameError:
-            # Python 3
-            if not isinstance(msg, str):
-                return msg
-
-        if self.keyword:
-            return msg.replace(self.keyword, "*" * len(self.keyword))
-        else:
-            return msg
-
-    def filter(self, record):
-        record.msg = self.censor(record.msg)
-        record.args = tuple(self.censor(arg) for arg in record.args)
-        return True
+def censor(keyword):
+    # Censoring is applied only when records are actually written
+    if keyword:
+        LogFormatter.censored.add(keyword)
 
 
 def setup_logging(verbosity, stream=sys.stdout):
+    # Engine I/O is only logged at the highest verbosity. Otherwise the
+    # tracing is not even called.
+    set_engine_trace(verbosity >= 3)
+
     logger = logging.getLogger()
-    logger.setLevel(ENGINE)
+    logger.setLevel(ENGINE if verbosity >= 3 else logging.DEBUG)
 
     handler = logging.StreamHandler(stream)
 
@@ -252,11 +285,39 @@ def base_url(url):
     return "%s://%s/" % (url_info.scheme, url_info.hostname)
 
 
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value.strip()))
+    except ValueError:
+        pass
+
+    date = email.utils.parsedate_tz(value.strip())
+    if date is None:
+        return None
+
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def parse_queue_hint(response):
+    try:
+        return int(response.getheader("X-Fishnet-Queue", "").strip())
+    except ValueError:
+        return None
+
+
 class HttpError(Exception):
-    def __init__(self, status, reason, body):
+    def __init__(self, status, reason, body, retry_after=None):
         self.status = status
         self.reason = reason
         self.body = body
+        self.retry_after = retry_after
+
+    def is_overload(self):
+        return self.status in [429, 503]
 
     def __str__(self):
         return "HTTP %d %s\n\n%s" % (self.status, self.reason, self.body)
@@ -275,32 +336,38 @@ class HttpClientError(HttpError):
 
 
 @contextlib.contextmanager
-def http(method, url, body=None, headers=None):
+def http(method, url, body=None, headers=None, timeout=HTTP_TIMEOUT):
     logging.debug("HTTP request: %s %s, body: %s", method, url, body)
 
     url_info = urlparse.urlparse(url)
     if url_info.scheme == "https":
         con = httplib.HTTPSConnection(url_info.hostname, url_info.port or 443,
-                                      timeout=HTTP_TIMEOUT)
+                                      timeout=timeout)
     else:
         con = httplib.HTTPConnection(url_info.hostname, url_info.port or 80,
-                                     timeout=HTTP_TIMEOUT)
+                                     timeout=timeout)
 
     headers_with_useragent = {"User-Agent": "fishnet %s" % __version__}
     if headers:
         headers_with_useragent.update(headers)
 
-    con.request(method, url_info.path, body, headers_with_useragent)
+    path = url_info.path
+    if url_info.query:
+        path += "?" + url_info.query
+
+    con.request(method, path, body, headers_with_useragent)
     response = con.getresponse()
     logging.debug("HTTP response: %d %s", response.status, response.reason)
 
     try:
         if 400 <= response.status < 500:
             raise HttpClientError(response.status, response.reason,
-                                  response.read())
+                                  response.read(),
+                                  parse_retry_after(response.getheader("Retry-After")))
         elif 500 <= response.status < 600:
             raise HttpServerError(response.status, response.reason,
-                                  response.read())
+                                  response.read(),
+                                  parse_retry_after(response.getheader("Retry-After")))
         else:
             yield response
     finally:
@@ -350,8 +417,7 @@ def open_process(command, cwd=None, shell=True, _popen_lock=threading.Lock()):
         "stdout": subprocess.PIPE,
         "stderr": subprocess.STDOUT,
         "stdin": subprocess.PIPE,
-        "bufsize": 1,  # Line buffered
-        "universal_newlines": True,
+        "bufsize": 0,  # Unbuffered bytes. Lines are split by LineReader.
     }
 
     if cwd is not None:
@@ -365,8 +431,38 @@ def open_process(command, cwd=None, shell=True, _popen_lock=threading.Lock()):
         # Unix
         kwargs["preexec_fn"] = os.setpgrp
 
-    with _popen_lock:  # Work around Python 2 Popen race condition
-        return subprocess.Popen(command, **kwargs)
+    if sys.version_info[0] < 3 and subprocess.__name__ == "subprocess":
+        with _popen_lock:  # Work around Python 2 Popen race condition
+            process = subprocess.Popen(command, **kwargs)
+    else:
+        # Spawn engines in parallel
+        process = subprocess.Popen(command, **kwargs)
+
+    process.reader = LineReader(process.stdout)
+    return process
+
+
+class LineReader(object):
+    # Reads lines from a pipe in bulk, without decoding them
+
+    def __init__(self, f):
+        self.fd = f.fileno()
+        self.lines = collections.deque()
+        self.partial = b""
+
+    def readline(self):
+        # Returns the next line (with trailing whitespace), or None at EOF
+        while not self.lines:
+            chunk = os.read(self.fd, PIPE_CHUNK)
+            if not chunk:
+                line, self.partial = self.partial, b""
+                return line or None
+
+            lines = (self.partial + chunk).split(b"\n")
+            self.partial = lines.pop()
+            self.lines.extend(lines)
+
+        return self.lines.popleft()
 
 
 def kill_process(p):
@@ -378,28 +474,55 @@ def kill_process(p):
         os.killpg(p.pid, signal.SIGKILL)
 
 
-def send(p, line):
-    logging.log(ENGINE, "%s << %s", p.pid, line)
-    p.stdin.write(line + "\n")
+def send_quiet(p, line):
+    p.stdin.write((line + "\n").encode("utf-8"))
     p.stdin.flush()
 
 
-def recv(p):
+def recv_quiet(p, skip=None):
+    # Lines matching the skip pattern are dropped without decoding
     while True:
-        line = p.stdout.readline()
-        if line == "":
+        line = p.reader.readline()
+        if line is None:
             raise EOFError()
 
         line = line.rstrip()
+        if line and (skip is None or not skip.match(line)):
+            return line.decode("utf-8", "replace")
 
-        logging.log(ENGINE, "%s >> %s", p.pid, line)
 
-        if line:
-            return line
+def send_traced(p, line):
+    logging.log(ENGINE, "%s << %s", p.pid, line)
+    send_quiet(p, line)
+
+
+def recv_traced(p, skip=None):
+    while True:
+        line = p.reader.readline()
+        if line is None:
+            raise EOFError()
+
+        line = line.rstrip()
+
+        logging.log(ENGINE, "%s >> %s", p.pid, line.decode("utf-8", "replace"))
+
+        if line and (skip is None or not skip.match(line)):
+            return line.decode("utf-8", "replace")
+
+
+send, recv = send_quiet, recv_quiet
+
+
+def set_engine_trace(enabled):
+    global send, recv
+    if enabled:
+        send, recv = send_traced, recv_traced
+    else:
+        send, recv = send_quiet, recv_quiet
 
 
-def recv_uci(p):
-    command_and_args = recv(p).split(None, 1)
+def recv_uci(p, skip=None):
+    command_and_args = recv(p, skip).split(None, 1)
     if len(command_and_args) == 1:
         return command_and_args[0], ""
     elif len(command_and_args) == 2:
@@ -488,46 +611,61 @@ def go(p, position, moves, movetime=None, clock=None, depth=None, nodes=None):
     info = {}
     info["bestmove"] = None
 
+    # Secondary lines by multipv index
+    pvs = {}
+
     while True:
-        command, arg = recv_uci(p)
+        # Progress updates about the current move are not reported
+        command, arg = recv_uci(p, CURRMOVE)
 
         if command == "bestmove":
-            bestmove = arg.split()[0]
+            tokens = arg.split()
+            bestmove = tokens[0]
             if bestmove and bestmove != "(none)":
                 info["bestmove"] = bestmove
+            if len(tokens) >= 3 and tokens[1] == "ponder":
+                info["ponder"] = tokens[2]
+            if pvs:
+                info["pvs"] = [pv_summary(info)] + [pv_summary(pvs[k]) for k in sorted(pvs)]
             isready(p)
             return info
         elif command == "info":
-            arg = arg or ""
+            tokens = (arg or "").split(" ")
+
+            # Secondary lines are parsed separately
+            target = info
+            if tokens[0] != "string" and "multipv" in tokens:
+                try:
+                    multipv = int(tokens[tokens.index("multipv") + 1])
+                except (ValueError, IndexError):
+                    multipv = 1
+                if multipv > 1:
+                    target = pvs[multipv] = {}
 
             # Parse all other parameters
             score_kind, score_value, score_bound = None, None, False
             current_parameter = None
-            for token in arg.split(" "):
+            for token in tokens:
                 if current_parameter == "string":
                     # Everything until the end of line is a string
-                    if "string" in info:
-                        info["string"] += " " + token
+                    if "string" in target:
+                        target["string"] += " " + token
                     else:
-                        info["string"] = token
+                        target["string"] = token
                 elif token == "score":
                     current_parameter = "score"
-                elif token == "pv":
-                    current_parameter = "pv"
-                    if info.get("multipv", 1) == 1:
-                        info.pop("pv", None)
                 elif token in ["depth", "seldepth", "time", "nodes", "multipv",
                                "currmove", "currmovenumber",
                                "hashfull", "nps", "tbhits", "cpuload",
-                               "refutation", "currline", "string"]:
+                               "refutation", "currline", "string", "pv"]:
                     current_parameter = token
-                    info.pop(current_parameter, None)
+                    target.pop(current_parameter, None)
                 elif current_parameter in ["depth", "seldepth", "time",
                                            "nodes", "currmovenumber",
                                            "hashfull", "nps", "tbhits",
                                            "cpuload", "multipv"]:
                     # Integer parameters
-                    info[current_parameter] = int(token)
+                    target[current_parameter] = int(token)
                 elif current_parameter == "score":
                     # Score
                     if token in ["cp", "mate"]:
@@ -537,22 +675,50 @@ def go(p, position, moves, movetime=None, clock=None, depth=None, nodes=None):
                         score_bound = True
                     else:
                         score_value = int(token)
-                elif current_parameter != "pv" or info.get("multipv", 1) == 1:
+                else:
                     # Strings
-                    if current_parameter in info:
-                        info[current_parameter] += " " + token
+                    if current_parameter in target:
+                        target[current_parameter] += " " + token
                     else:
-                        info[current_parameter] = token
+                        target[current_parameter] = token
 
             # Set score if not just a bound
             if score_kind and score_value is not None and not score_bound:
-                info["score"] = {score_kind: score_value}
+                target["score"] = {score_kind: score_value}
         else:
             logging.warning("Unexpected engine output: %s %s", command, arg)
 
 
+def stop(p):
+    # Stop a running search and discard its results
+    send(p, "stop")
+    while recv_uci(p, CURRMOVE)[0] != "bestmove":
+        pass
+    isready(p)
+
+
+def pv_summary(line):
+    summary = {}
+    for key in ["depth", "score", "pv"]:
+        if key in line:
+            summary[key] = line[key]
+    return summary
+
+
+def set_multipv(p, multipv):
+    # Only touch the option when it changes
+    if getattr(p, "multipv", 1) != multipv:
+        setoption(p, "MultiPV", multipv)
+        p.multipv = multipv
+
+
 def set_variant_options(p, variant):
+    # Switching variants reinitialises the engine. Returns whether the
+    # options were changed.
     variant = variant.lower()
+    if getattr(p, "variant", None) == variant:
+        return False
+    p.variant = variant
 
     setoption(p, "UCI_Chess960", variant in ["fromposition", "chess960"])
 
@@ -563,13 +729,229 @@ def set_variant_options(p, variant):
     else:
         setoption(p, "UCI_Variant", variant)
 
+    return True
+
+
+def acquire_path(long_poll=0, lane=None):
+    # Query only for the job types served by this worker and let the server
+    # hold the request until a job is available
+    query = []
+    if long_poll:
+        query.append("wait=%d" % long_poll)
+    if lane:
+        query.append("lane=%s" % lane)
+    return "acquire?" + "&".join(query) if query else "acquire"
+
+
+class Governor(object):
+    # Coordinates job acquisition of all workers in a process. Only a single
+    # idle worker (the poller) keeps asking for jobs, while other idle
+    # workers wait until it finds one. The backoff state is shared.
+    #
+    # Backoffs are scaled by a pressure factor, that drops when the server
+    # hints at plenty of queued jobs and rises when it is overloaded.
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.cond = threading.Condition()
+        self.backoff = start_backoff(conf)
+        self.poller = None
+        self.generation = 0
+        self.pressure = 1.0
+        self.not_before = 0.0
+        self.suspended = collections.deque()
+        self.handoffs = collections.deque()
+        self.waiters = []
+        self.sleepers = []
+        self.handed_off = 0
+        self.routed = collections.Counter()
+
+    def is_polling(self, worker):
+        return worker.is_alive() and not worker.finished.is_set()
+
+    def _next_backoff(self):
+        t = next(self.backoff) * self.pressure
+        return max(t, self.not_before - time.time())
+
+    def next_backoff(self):
+        with self.cond:
+            return self._next_backoff()
+
+    def overloaded(self, retry_after=None):
+        with self.cond:
+            self.pressure = min(self.pressure * 2, MAX_PRESSURE)
+            if retry_after is not None:
+                self.not_before = max(self.not_before, time.time() + retry_after)
+            return self._next_backoff()
+
+    def got_job(self, worker, queue=None):
+        with self.cond:
+            self.backoff = start_backoff(self.conf)
+            if self.poller is worker:
+                self.poller = None
+
+            if queue:
+                # Plenty of jobs. Poll more eagerly.
+                self.pressure = max(self.pressure / 2, MIN_PRESSURE)
+            elif self.pressure > 1.0:
+                self.pressure = max(self.pressure / 2, 1.0)
+
+            # Wake idle workers to look for more jobs
+            self.generation += 1
+            self.cond.notify_all()
+
+    def no_job(self, worker, backoff=True):
+        with self.cond:
+            if self.pressure < 1.0:
+                self.pressure = min(self.pressure * 2, 1.0)
+
+            if self.poller is None or self.poller is worker or not self.is_polling(self.poller):
+                self.poller = worker
+                t = self._next_backoff() if backoff else None
+                if t is None:
+                    return
+            else:
+                t = None
+
+        if t is not None:
+            # The sleeping poller is idle, too
+            logging.debug("No job found. Backing off %0.1fs", t)
+            with self.cond:
+                self.sleepers.append(worker)
+            try:
+                worker.wait(t)
+            finally:
+                with self.cond:
+                    self.sleepers.remove(worker)
+            return
+
+        # Wait for the poller
+        logging.debug("No job found. Waiting for other workers")
+        start = time.time()
+        with self.cond:
+            generation = self.generation
+            self.waiters.append(worker)
+            try:
+                while (generation == self.generation and worker.is_alive() and
+                       worker.active.is_set() and not worker.retiring):
+                    if self.poller is None or not self.is_polling(self.poller):
+                        break
+                    if self._has_handoff(worker):
+                        break
+                    self.cond.wait(MAX_BACKOFF)
+            finally:
+                self.waiters.remove(worker)
+        worker.time_waiting += time.time() - start
+
+    def suspend(self, task):
+        with self.cond:
+            self.suspended.append(task)
+
+            # Wake an idle worker to continue
+            self.generation += 1
+            self.cond.notify_all()
+
+    def resume(self):
+        with self.cond:
+            return self.suspended.popleft() if self.suspended else None
+
+    def overdue(self, interval=PROGRESS_REPORT_INTERVAL):
+        # Suspended tasks that are due for a progress report. Claimed by the
+        # caller, so that each report is sent only once.
+        now = time.time()
+        with self.cond:
+            tasks = [task for task in self.suspended if task.last_progress_report + interval < now]
+            for task in tasks:
+                task.last_progress_report = now
+            return tasks
+
+    def wake(self, worker):
+        # Let an idle worker get to its next job boundary right away
+        with self.cond:
+            if worker in self.sleepers:
+                worker.wake()
+            self.cond.notify_all()
+
+    def _has_handoff(self, worker):
+        return any(target is worker for _, target in self.handoffs)
+
+    def _idle(self):
+        return [w for w in self.waiters + self.sleepers if not self._has_handoff(w)]
+
+    def _hand_to(self, job, target):
+        self.handoffs.append((job, target))
+        if target in self.sleepers:
+            target.wake()
+        self.cond.notify_all()
+
+    def handoff(self, job, target=None):
+        # Pass a job to an idle worker, if any
+        with self.cond:
+            if target is None:
+                target = next(iter(self._idle()), None)
+                if target is None:
+                    return False
+
+            self._hand_to(job, target)
+            self.handed_off += 1
+            return True
+
+    def take_handoff(self, worker=None):
+        with self.cond:
+            for i, (job, target) in enumerate(self.handoffs):
+                if worker is None or target is worker or target is None:
+                    del self.handoffs[i]
+                    return job
+            return None
+
+    def route(self, job, worker):
+        # Pass a job to an idle worker that served the same game (with a warm
+        # hash) or at least has its engine set up for the variant
+        game_id = job.get("game_id")
+        variant = job.get("variant", "standard").lower()
+
+        with self.cond:
+            if worker.last_game == game_id:
+                return False
+
+            candidates = [w for w in self._idle() if w is not worker]
+            target = next((w for w in candidates if w.last_game == game_id), None)
+            if target is not None:
+                self.routed["game"] += 1
+            elif worker.engine_variant() != variant:
+                target = next((w for w in candidates if w.engine_variant() == variant), None)
+                if target is None:
+                    return False
+                self.routed["variant"] += 1
+            else:
+                return False
+
+            self._hand_to(job, target)
+            return True
+
+    def release(self, worker):
+        with self.cond:
+            if self.poller is worker:
+                self.poller = None
+
+            # Let anyone take jobs that were handed to this worker
+            self.handoffs = collections.deque((job, None if target is worker else target)
+                                              for job, target in self.handoffs)
+            self.cond.notify_all()
+
 
 class Worker(threading.Thread):
-    def __init__(self, conf, threads, memory):
+    def __init__(self, conf, threads, memory, governor=None, lane=None, settings=None,
+                 broker=None, light=None):
         super(Worker, self).__init__()
         self.conf = conf
+        self._settings = settings
         self.threads = threads
         self.memory = memory
+        self.governor = governor or Governor(conf)
+        self.lane = lane
+        self.broker = broker
+        self.light = light
 
         self.alive = True
         self.fatal_error = None
@@ -579,12 +961,50 @@ class Worker(threading.Thread):
 
         self.nodes = 0
         self.positions = 0
+        self.moves = 0
+
+        self.ponder_next = None
+        self.pondering = None
+        self.last_ponder = None
+        self.ponder_searches = 0
+        self.ponder_hits = 0
+
+        self.last_game = None
+        self.game_hits = 0
+        self.variant_hits = 0
+        self.variant_switches = 0
+        self.variant_switch_time = 0.0
+        self.time_waiting = 0.0
+        self.time_working = 0.0
+        self.move_latencies = collections.deque(maxlen=MOVE_LATENCY_SAMPLES)
 
         self.stockfish = None
         self.stockfish_info = None
+        self.hash = None
+        self.ready = threading.Event()
+        self.ready_time = None
 
         self.job = None
-        self.backoff = start_backoff(self.conf)
+        self.task = None
+        self.yield_requested = threading.Event()
+
+        self.active = threading.Event()
+        self.active.set()
+        self.time_parked = 0.0
+
+        self.retiring = False
+        self.resize = None
+
+    @property
+    def settings(self):
+        # Validated on first use, unless shared by the caller
+        if self._settings is None:
+            self._settings = load_settings(self.conf)
+        return self._settings
+
+    @settings.setter
+    def settings(self, settings):
+        self._settings = settings
 
     def stop(self):
         with self.status_lock:
@@ -594,11 +1014,61 @@ class Worker(threading.Thread):
                 kill_process(self.stockfish)
 
             self.sleep.set()
+            self.active.set()
+
+        self.governor.release(self)
+
+    def park(self):
+        # Stop at the next job boundary until resumed. Analysis is suspended
+        # at the next ply.
+        self.active.clear()
+        self.preempt()
+        self.governor.release(self)
+
+    def unpark(self):
+        self.yield_requested.clear()
+        self.active.set()
+
+    def retire(self):
+        # Stop for good at the next job boundary. Suspended analysis is left
+        # to the other workers. Wakes the worker if it is parked.
+        self.retiring = True
+        self.park()
+        self.active.set()
+        self.governor.wake(self)
+
+    def request_resize(self, threads, memory):
+        with self.status_lock:
+            self.resize = (threads, memory)
+        self.governor.wake(self)
+
+    def apply_resize(self):
+        with self.status_lock:
+            resize, self.resize = self.resize, None
+
+        self.threads, self.memory = resize
+        logging.info("Resizing engine to %d threads and %d MB hash", self.threads, self.memory)
+        setoption(self.stockfish, "Threads", self.threads)
+        self.stockfish_info["options"]["threads"] = str(self.threads)
+        self.set_hash(self.memory)
+        isready(self.stockfish)
 
     def is_alive(self):
         with self.status_lock:
             return self.alive
 
+    def wait(self, t):
+        start = time.time()
+        self.sleep.wait(t)
+        with self.status_lock:
+            if self.alive:
+                self.sleep.clear()
+        self.time_waiting += time.time() - start
+
+    def wake(self):
+        # Cut a backoff short, for example to take a handoff
+        self.sleep.set()
+
     def run(self):
         try:
             while self.is_alive():
@@ -628,32 +1098,76 @@ class Worker(threading.Thread):
             if not self.stockfish or self.stockfish.returncode is not None:
                 self.start_stockfish()
 
+            # Resize between jobs
+            if self.resize and not self.task:
+                self.apply_resize()
+
+            # Retire or park at a job boundary
+            if self.retiring and not self.job:
+                logging.info("Retiring worker")
+                self.stop()
+                return
+
+            if not self.job and not self.active.is_set():
+                start = time.time()
+                self.active.wait()
+                self.time_parked += time.time() - start
+                return
+
             # Do the next work unit
+            start = time.time()
             path, request = self.work()
+            if self.job:
+                self.time_working += time.time() - start
+
+            # Do not take new jobs while parked or retiring
+            if path == "acquire" and (self.retiring or not self.active.is_set()):
+                self.job = None
+                return
 
-            # Report result and fetch next job
-            with http("POST", get_endpoint(self.conf, path), json.dumps(request)) as response:
-                if response.status == 204:
+            # Suspended analysis is still in progress
+            for task in self.governor.overdue():
+                self.send_analysis_progress(task.job, task.result)
+
+            # Report result and fetch next job, meanwhile pondering on the
+            # otherwise idle engine
+            self.start_ponder()
+            try:
+                self.job = self.fetch(path, request)
+            finally:
+                try:
+                    self.stop_ponder()
+                except Exception:
+                    logging.exception("Could not stop pondering")
+
+            # Results are answered with the next job. Pass it on, if parked
+            # or retiring in the meantime.
+            if self.job and (self.retiring or not self.active.is_set()):
+                if self.governor.handoff(self.job):
                     self.job = None
-                    t = next(self.backoff)
-                    logging.debug("No job found. Backing off %0.1fs", t)
-                    self.sleep.wait(t)
                 else:
-                    data = response.read().decode("utf-8")
-                    logging.debug("Got job: %s", data)
-
-                    self.job = json.loads(data)
-                    self.backoff = start_backoff(self.conf)
+                    self.abort_job()
         except HttpServerError as err:
             self.job = None
-            t = next(self.backoff)
+            if err.is_overload():
+                t = self.governor.overloaded(err.retry_after)
+            else:
+                t = self.governor.next_backoff()
             logging.error("Server error: HTTP %d %s. Backing off %0.1fs", err.status, err.reason, t)
-            self.sleep.wait(t)
+            self.wait(t)
         except HttpClientError as err:
             self.job = None
-            t = next(self.backoff)
+            if err.is_overload():
+                t = self.governor.overloaded(err.retry_after)
+                logging.error("Server overloaded: HTTP %d %s. Backing off %0.1fs",
+                              err.status, err.reason, t)
+                self.wait(t)
+                return
+
+            t = self.governor.next_backoff()
             try:
-                logging.debug("Client error: HTTP %d %s: %s", err.status, err.reason, err.body.decode("utf-8"))
+                logging.debug("Client error: HTTP %d %s: %s",
+                              err.status, err.reason, err.body.decode("utf-8"))
                 error = json.loads(err.body.decode("utf-8"))["error"]
                 logging.error(error)
 
@@ -663,36 +1177,73 @@ class Worker(threading.Thread):
             except (KeyError, ValueError):
                 logging.error("Client error: HTTP %d %s. Backing off %0.1fs. Request was: %s",
                               err.status, err.reason, t, json.dumps(request))
-            self.sleep.wait(t)
+            self.wait(t)
         except dead_engine_errors:
             alive = self.is_alive()
             if alive:
-                t = next(self.backoff)
+                t = self.governor.next_backoff()
                 logging.exception("Engine process has died. Backing off %0.1fs", t)
 
             # Abort current job
             self.abort_job()
 
             if alive:
-                self.sleep.wait(t)
+                self.wait(t)
                 kill_process(self.stockfish)
         except Exception:
             self.job = None
-            t = next(self.backoff)
+            t = self.governor.next_backoff()
             logging.exception("Backing off %0.1fs after exception in worker", t)
-            self.sleep.wait(t)
+            self.wait(t)
 
             # If in doubt, restart engine
             kill_process(self.stockfish)
 
+    def fetch(self, path, request):
+        # Exchange with a local job source instead of the server
+        if self.broker:
+            return self.broker.exchange(self, path, request)
+
+        timeout = HTTP_TIMEOUT
+
+        # Let the server hold the request until a job is available
+        long_poll = self.settings.long_poll if path == "acquire" else 0
+        if long_poll:
+            timeout += long_poll
+
+        if path == "acquire":
+            path = acquire_path(long_poll, self.lane)
+
+        start = time.time()
+        with http("POST", self.settings.endpoint + path, json.dumps(request),
+                  timeout=timeout) as response:
+            if response.status == 204:
+                # Back off unless the server already held the request
+                held = long_poll and time.time() - start >= long_poll / 2
+                self.governor.no_job(self, backoff=not held)
+                return None
+            else:
+                data = response.read().decode("utf-8")
+                logging.debug("Got job: %s", data)
+
+                self.governor.got_job(self, parse_queue_hint(response))
+                return json.loads(data)
+
     def abort_job(self):
         if self.job is None:
             return
 
         logging.debug("Aborting job %s", self.job["work"]["id"])
+        self.task = None
+
+        if self.broker:
+            self.broker.abort(self, self.job)
+            self.job = None
+            return
 
         try:
-            with http("POST", get_endpoint(self.conf, "abort/%s" % self.job["work"]["id"]), json.dumps(self.make_request())) as response:
+            with http("POST", self.settings.endpoint + "abort/%s" % self.job["work"]["id"],
+                      json.dumps(self.make_request())) as response:
                 response.read()
                 logging.info("Aborted job %s", self.job["work"]["id"])
         except:
@@ -705,7 +1256,7 @@ class Worker(threading.Thread):
         self.stockfish = open_process(get_stockfish_command(self.conf, False),
                                       get_engine_dir(self.conf))
 
-        self.stockfish_info, _ = uci(self.stockfish)
+        self.stockfish_info, options = uci(self.stockfish)
         self.stockfish_info.pop("author", None)
         logging.info("Started %s, threads: %s (%d), pid: %d",
                      self.stockfish_info.get("name", "Stockfish <?>"),
@@ -714,7 +1265,19 @@ class Worker(threading.Thread):
         # Prepare UCI options
         self.stockfish_info["options"] = {}
         self.stockfish_info["options"]["threads"] = str(self.threads)
-        self.stockfish_info["options"]["hash"] = str(self.memory)
+
+        # Sized once. Engines of the analysis lane also play moves, but keep
+        # their full hash rather than reallocating it for each job type.
+        # Move engines are small to begin with (see worker_layout).
+        self.hash = self.memory
+        self.stockfish_info["options"]["hash"] = str(self.hash)
+        if "Large Pages" in options and get_large_pages(self.conf):
+            self.stockfish_info["options"]["large pages"] = "true"
+
+        # Not reported, because it is a local path
+        syzygy_path = get_syzygy_path(self.conf)
+        if syzygy_path and "SyzygyPath" in options:
+            setoption(self.stockfish, "SyzygyPath", syzygy_path)
 
         # Custom options
         if self.conf.has_section("Stockfish"):
@@ -727,23 +1290,117 @@ class Worker(threading.Thread):
 
         isready(self.stockfish)
 
+        logging.debug("Engine ready %0.3fs after startup", time.time() - STARTUP)
+        if self.ready_time is None:
+            self.ready_time = time.time()
+        self.ready.set()
+
     def make_request(self):
         return {
-            "fishnet": {
-                "version": __version__,
-                "python": platform.python_version(),
-                "apikey": get_key(self.conf),
-            },
+            "fishnet": dict(self.settings.fishnet_info),
             "stockfish": self.stockfish_info,
         }
 
+    def start_ponder(self):
+        # Search the expected position of the next move job for the game
+        # that was just played, so that its search starts with a warm hash.
+        # Changing the number of threads would clear the hash, so the search
+        # is kept short instead.
+        job, self.ponder_next = self.ponder_next, None
+        if not job:
+            return
+
+        send(self.stockfish, "position fen %s moves %s" % (job["position"], " ".join(job["moves"])))
+        send(self.stockfish, "go movetime %d" % PONDER_MOVETIME)
+        self.pondering = job
+        self.ponder_searches += 1
+
+    def stop_ponder(self):
+        job, self.pondering = self.pondering, None
+        if job:
+            stop(self.stockfish)
+            self.last_ponder = job
+
+    def engine_variant(self):
+        return getattr(self.stockfish, "variant", None)
+
+    def setup_game(self, job):
+        # Track how often the engine is already set up for a job
+        if job.get("game_id") == self.last_game:
+            self.game_hits += 1
+        self.last_game = job.get("game_id")
+
+        start = time.time()
+        if set_variant_options(self.stockfish, job.get("variant", "standard")):
+            isready(self.stockfish)
+            self.variant_switches += 1
+            self.variant_switch_time += time.time() - start
+        else:
+            self.variant_hits += 1
+
+    def set_hash(self, size):
+        # Only on explicit resizes, unless the hash is a custom option
+        if self.hash == size or conf_get(self.conf, "hash", section="Stockfish"):
+            return
+
+        logging.debug("Resizing hash from %d MB to %d MB", self.hash, size)
+        setoption(self.stockfish, "Hash", size)
+        self.stockfish_info["options"]["hash"] = str(size)
+        self.hash = size
+
     def work(self):
         result = self.make_request()
 
+        # Play moves handed off by other workers, then continue suspended
+        # analysis, before acquiring new jobs
+        if not self.job:
+            self.job = self.governor.take_handoff(self)
+        if not self.job:
+            self.task = self.governor.resume()
+            if self.task:
+                self.job = self.task.job
+                self.task.request = self.make_request()
+
+        # Engines reserved for moves are too small for anything else, even
+        # if the server ignores the lane
+        if self.job and self.lane == "move" and self.job["work"]["type"] != "move":
+            logging.warning("Aborting %s job %s on move engine",
+                            self.job["work"]["type"], self.job["work"]["id"])
+            self.abort_job()
+            self.wait(self.governor.next_backoff())
+            return "acquire", self.make_request()
+
         if self.job and self.job["work"]["type"] == "analysis":
-            result = self.analysis(self.job)
+            if not self.task:
+                self.task = AnalysisTask(self.job, result,
+                                         self.settings.analysis, self.settings.tablebase)
+            result = self.run_analysis(self.task)
+            if result is None:
+                # Suspended. Leave it to any idle worker.
+                self.governor.suspend(self.task)
+                self.task = None
+                self.job = None
+                return "acquire", self.make_request()
+
+            self.task = None
             return "analysis" + "/" + self.job["work"]["id"], result
         elif self.job and self.job["work"]["type"] == "move":
+            # Prefer an idle worker that is already set up for the game
+            if self.governor.route(self.job, self):
+                logging.debug("Routed %s%s to another worker",
+                              self.settings.base_url, self.job["game_id"])
+                self.job = None
+                return "acquire", result
+
+            # Leave low levels to idle light engines
+            if self.light and self.job["work"]["level"] <= self.settings.light_level and \
+                    self.light.handoff(self.job):
+                logging.debug("Handed off %s%s with lvl %d to a light engine",
+                              self.settings.base_url, self.job["game_id"],
+                              self.job["work"]["level"])
+                self.job = None
+                return "acquire", result
+
             result = self.bestmove(self.job)
             return "move" + "/" + self.job["work"]["id"], result
         else:
@@ -756,29 +1413,44 @@ class Worker(threading.Thread):
         lvl = job["work"]["level"]
         variant = job.get("variant", "standard")
         moves = job["moves"].split(" ")
+        start = time.time()
 
         logging.debug("Playing %s%s (%s) with lvl %d",
-                      base_url(get_endpoint(self.conf)), job["game_id"],
+                      self.settings.base_url, job["game_id"],
                       variant, lvl)
 
-        set_variant_options(self.stockfish, job.get("variant", "standard"))
+        if self.last_ponder and self.last_ponder["game_id"] == job["game_id"] and \
+                self.last_ponder["moves"] == [move for move in moves if move]:
+            self.ponder_hits += 1
+
+        self.setup_game(job)
         setoption(self.stockfish, "Skill Level", int(round((lvl - 1) * 20.0 / 7)))
+        set_multipv(self.stockfish, 1)
         isready(self.stockfish)
 
         movetime = int(round(LVL_MOVETIMES[lvl - 1] / (self.threads * 0.9 ** (self.threads - 1))))
 
-        start = time.time()
         part = go(self.stockfish, job["position"], moves,
                   movetime=movetime, clock=job["work"].get("clock"),
                   depth=LVL_DEPTHS[lvl - 1])
         end = time.time()
+        self.move_latencies.append(end - start)
 
         logging.log(PROGRESS, "Played move in %s%s (%s) with lvl %d: %0.3fs elapsed, depth %d",
-                    base_url(get_endpoint(self.conf)), job["game_id"], variant,
+                    self.settings.base_url, job["game_id"], variant,
                     lvl, end - start, part.get("depth", 0))
 
         self.nodes += part.get("nodes", 0)
         self.positions += 1
+        self.moves += 1
+
+        # Ponder on the expected reply when idle
+        if self.settings.ponder and part.get("ponder"):
+            self.ponder_next = {
+                "game_id": job["game_id"],
+                "position": job["position"],
+                "moves": [move for move in moves if move] + [part["bestmove"], part["ponder"]],
+            }
 
         result = self.make_request()
         result["move"] = {
@@ -787,229 +1459,957 @@ class Worker(threading.Thread):
         return result
 
     def send_analysis_progress(self, job, result):
+        if self.broker:
+            return self.broker.progress(self, job, result)
+
         path = "analysis/%s" % job["work"]["id"]
 
         try:
-            with http("POST", get_endpoint(self.conf, path), json.dumps(result)) as response:
+            with http("POST", self.settings.endpoint + path, json.dumps(result)) as response:
                 if response.status != 204:
-                    logging.error("Expected status 204 for progress report, got %d", response.status)
+                    logging.error("Expected status 204 for progress report, got %d",
+                                  response.status)
             return True
         except:
             logging.exception("Could not send progress report. Continuing.")
             return False
 
     def analysis(self, job, progress_report_interval=PROGRESS_REPORT_INTERVAL):
-        variant = job.get("variant", "standard")
-        moves = job["moves"].split(" ")
+        task = AnalysisTask(job, self.make_request(), self.settings.analysis,
+                            self.settings.tablebase)
+        return self.run_analysis(task, progress_report_interval)
+
+    def run_analysis(self, task, progress_report_interval=PROGRESS_REPORT_INTERVAL):
+        # Returns the result, or None if the task has been suspended
+        self.setup_game(task.job)
+        task.prepare(self.stockfish)
+        start = time.time()
 
-        result = self.make_request()
-        result["analysis"] = [None for _ in range(len(moves) + 1)]
-        start = last_progress_report = time.time()
+        while not task.is_done():
+            if self.yield_requested.is_set():
+                self.yield_requested.clear()
+                task.elapsed += time.time() - start
+                logging.info("Suspending %s%s at ply %d",
+                             self.settings.base_url, task.job["game_id"],
+                             task.next_ply)
+                return None
 
-        set_variant_options(self.stockfish, variant)
-        setoption(self.stockfish, "Skill Level", 20)
-        isready(self.stockfish)
+            if task.last_progress_report + progress_report_interval < time.time():
+                if self.send_analysis_progress(task.job, task.result):
+                    task.last_progress_report = time.time()
 
-        send(self.stockfish, "ucinewgame")
-        isready(self.stockfish)
+            logging.log(PROGRESS, "Analysing %s game %s%s#%d",
+                        task.variant,
+                        self.settings.base_url, task.job["game_id"],
+                        task.next_ply)
 
-        nodes = job.get("nodes") or 3500000
+            part = task.step(self.stockfish)
 
-        for ply in range(len(moves), -1, -1):
-            if last_progress_report + progress_report_interval < time.time():
-                if self.send_analysis_progress(job, result):
-                    last_progress_report = time.time()
+            self.nodes += part.get("nodes", 0)
+            self.positions += 1
 
-            logging.log(PROGRESS, "Analysing %s game %s%s#%d",
-                        variant,
-                        base_url(get_endpoint(self.conf)), job["game_id"], ply)
+        task.elapsed += time.time() - start
+        logging.info("%s%s took %0.1fs (%0.2fs per position)",
+                     self.settings.base_url, task.job["game_id"],
+                     task.elapsed, task.elapsed / len(task.plies))
 
-            part = go(self.stockfish, job["position"], moves[0:ply],
-                      nodes=nodes, movetime=4000)
+        return task.result
 
-            if "mate" not in part["score"] and "time" in part and part["time"] < 100:
-                logging.warning("Very low time reported: %d ms.", part["time"])
+    def preempt(self):
+        # Ask the worker to suspend its analysis at the next ply boundary
+        self.yield_requested.set()
 
-            if "nps" in part and part["nps"] >= 100000000:
-                logging.warning("Dropping exorbitant nps: %d", part["nps"])
-                del part["nps"]
 
-            self.nodes += part.get("nodes", 0)
-            self.positions += 1
+PIECES = " pnbrqk"
 
-            result["analysis"][ply] = part
 
-        end = time.time()
-        logging.info("%s%s took %0.1fs (%0.2fs per position)",
-                     base_url(get_endpoint(self.conf)), job["game_id"],
-                     end - start, (end - start) / (len(moves) + 1))
+def encode_move(uci):
+    # Packs a UCI move into 16 bits: from square (6), to square (6) and
+    # promotion piece (3), or drop piece (3) and to square (6) with the
+    # highest bit set. 0 is the null move.
+    if uci == "0000":
+        return 0
 
-        return result
+    if len(uci) == 4 and uci[1] == "@":
+        piece = PIECES.index(uci[0].lower())
+        return 0x8000 | piece << 12 | encode_square(uci[2:4])
 
+    if len(uci) not in [4, 5]:
+        raise ValueError("invalid uci: %r" % uci)
 
-def detect_cpu_capabilities():
-    # Detects support for popcnt and pext instructions
-    modern, bmi2 = False, False
+    promotion = PIECES.index(uci[4]) if len(uci) == 5 else 0
+    return encode_square(uci[0:2]) | encode_square(uci[2:4]) << 6 | promotion << 12
 
-    # Run cpuid in subprocess for robustness in case of segfaults
-    cmd = []
-    cmd.append(sys.executable)
-    if __package__ is not None:
-        cmd.append("-m")
-        cmd.append(os.path.splitext(os.path.basename(__file__))[0])
-    else:
-        cmd.append(__file__)
-    cmd.append("cpuid")
 
-    process = open_process(cmd, shell=False)
+def encode_square(name):
+    file_index, rank_index = "abcdefgh".index(name[0]), "12345678".index(name[1])
+    return rank_index * 8 + file_index
 
-    # Parse output
-    while True:
-        line = process.stdout.readline()
-        if not line:
-            break
 
-        line = line.rstrip()
-        logging.debug("cpuid >> %s", line)
-        if not line:
-            continue
+def decode_move(move):
+    if move == 0:
+        return "0000"
 
-        columns = line.split()
-        if columns[0] == "CPUID":
-            pass
-        elif len(columns) == 5 and all(all(c in string.hexdigits for c in col) for col in columns):
-            eax, a, b, c, d = [int(col, 16) for col in columns]
+    to_square = decode_square(move & 0x3f if move & 0x8000 else move >> 6 & 0x3f)
+    piece = PIECES[move >> 12 & 0x7]
+    if move & 0x8000:
+        return "%s@%s" % (piece.upper(), to_square)
 
-            # popcnt
-            if eax == 1 and c & (1 << 23):
-                modern = True
+    return decode_square(move & 0x3f) + to_square + piece.strip()
 
-            # pext
-            if eax == 7 and b & (1 << 8):
-                bmi2 = True
-        else:
-            logging.warning("Unexpected cpuid output: %s", line)
 
-    # Done
-    process.wait()
-    if process.returncode != 0:
-        logging.error("cpuid exited with status code %d", process.returncode)
+def decode_square(square):
+    return "abcdefgh"[square & 7] + "12345678"[square >> 3]
 
-    return modern, bmi2
 
+class PlyInfo(object):
+    # Compact analysis of a single ply. Moves are packed with encode_move().
+    # Rare fields are kept in the extra dict.
 
-def stockfish_filename():
-    machine = platform.machine().lower()
+    __slots__ = ["depth", "seldepth", "nodes", "nps", "time", "tbhits",
+                 "multipv", "score_kind", "score", "bestmove", "pv", "extra"]
 
-    modern, bmi2 = detect_cpu_capabilities()
-    if modern and bmi2:
-        suffix = "-bmi2"
-    elif modern:
-        suffix = "-modern"
-    else:
-        suffix = ""
+    INTEGERS = ["depth", "seldepth", "nodes", "nps", "time", "tbhits", "multipv"]
 
-    if os.name == "nt":
-        return "stockfish-windows-%s%s.exe" % (machine, suffix)
-    elif os.name == "os2" or sys.platform == "darwin":
-        return "stockfish-osx-%s" % machine
-    elif os.name == "posix":
-        return "stockfish-%s%s" % (machine, suffix)
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
 
+    @classmethod
+    def from_info(cls, info):
+        ply = cls()
+        for key, value in info.items():
+            try:
+                if key in cls.INTEGERS:
+                    setattr(ply, key, value)
+                elif key == "score" and len(value) == 1:
+                    ply.score_kind, ply.score = list(value.items())[0]
+                elif key == "bestmove":
+                    ply.bestmove = encode_move(value) if value is not None else None
+                elif key == "pv":
+                    ply.pv = array.array("H", [encode_move(move) for move in value.split()])
+                else:
+                    raise ValueError(key)
+            except ValueError:
+                if ply.extra is None:
+                    ply.extra = {}
+                ply.extra[key] = value
+        return ply
+
+    def to_json(self):
+        result = dict(self.extra) if self.extra else {}
+        for key in self.INTEGERS:
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = value
+        if self.score_kind is not None:
+            result["score"] = {self.score_kind: self.score}
+        if self.bestmove is not None:
+            result["bestmove"] = decode_move(self.bestmove)
+        elif "bestmove" not in result:
+            result["bestmove"] = None
+        if self.pv is not None:
+            result["pv"] = " ".join(decode_move(move) for move in self.pv)
+        return result
 
-def download_github_release(conf, release_page, filename):
-    path = os.path.join(get_engine_dir(conf), filename)
-    logging.info("Engine target path: %s", path)
 
-    headers = {}
+def analysis_profile(job, defaults=None):
+    # Search limits requested by the job take precedence
+    profile = dict(ANALYSIS_DEFAULTS)
+    profile.update(defaults or {})
 
-    # Only update to newer versions
-    try:
-        headers["If-Modified-Since"] = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(os.path.getmtime(path)))
-    except OSError:
-        pass
+    requested = dict((key, job["work"].get(key)) for key in ANALYSIS_DEFAULTS)
+    if job.get("nodes"):
+        requested["nodes"] = job["nodes"]
 
-    # Escape GitHub API rate limiting
-    if "GITHUB_API_TOKEN" in os.environ:
-        headers["Authorization"] = "token %s" % os.environ["GITHUB_API_TOKEN"]
+    # Values are checked like in validate_analysis_profile
+    for key, value in requested.items():
+        if value is None:
+            continue
 
-    # Find latest release
-    logging.info("Looking up %s ...", filename)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            value = 0
+
+        if value < 1:
+            logging.warning("Ignoring invalid analysis %s of job: %r", key, requested[key])
+        elif key == "multipv":
+            profile[key] = min(value, MAX_MULTIPV)
+        else:
+            profile[key] = value
 
-    with http("GET", release_page, headers=headers) as response:
-        if response.status == 304:
-            logging.info("Local %s is newer than release", filename)
-            return filename
+    return profile
 
-        release = json.loads(response.read().decode("utf-8"))
 
-    logging.info("Latest release is tagged %s", release["tag_name"])
+class AnalysisTask(object):
+    # Resumable analysis of a game. Plies are analysed from the end of the
+    # game, so the task can be suspended between plies and continued later,
+    # on the same or another engine.
 
-    for asset in release["assets"]:
-        if asset["name"] == filename:
-            logging.info("Found %s" % asset["browser_download_url"])
-            break
-    else:
-        raise ConfigError("No precompiled %s for your platform" % filename)
+    def __init__(self, job, request, defaults=None, tablebase=None):
+        self.job = job
+        self.variant = job.get("variant", "standard")
+        self.moves = job["moves"].split(" ")
+        self.profile = analysis_profile(job, defaults)
 
-    # Download
-    logging.info("Downloading %s ...", filename)
+        # Plies resolved by tablebases only need a short search
+        self.resolved = tablebase.resolved_plies(job) if tablebase else set()
 
-    def reporthook(a, b, c):
-        if sys.stderr.isatty():
-            sys.stderr.write("\rDownloading %s: %d/%d (%d%%)" % (
-                                 filename, min(a * b, c), c,
-                                 round(min(a * b, c) * 100 / c)))
-            sys.stderr.flush()
+        self.request = request
+        self.plies = [None for _ in range(len(self.moves) + 1)]
+        self.next_ply = len(self.moves)
 
-    urllib.urlretrieve(asset["browser_download_url"], path, reporthook)
+        self.engine = None
+        self.elapsed = 0.0
+        self.last_progress_report = time.time()
 
-    sys.stderr.write("\n")
-    sys.stderr.flush()
+    def is_done(self):
+        return self.next_ply < 0
 
-    # Make executable
-    logging.info("chmod +x %s", filename)
-    st = os.stat(path)
-    os.chmod(path, st.st_mode | stat.S_IEXEC)
-    return filename
+    @property
+    def result(self):
+        # Converted to the protocol representation only when needed
+        result = dict(self.request)
+        result["analysis"] = [ply.to_json() if ply else None for ply in self.plies]
+        return result
 
+    def prepare(self, p):
+        set_variant_options(p, self.variant)
+        setoption(p, "Skill Level", 20)
+        set_multipv(p, self.profile["multipv"])
+        isready(p)
 
-def update_stockfish(conf, filename):
-    return download_github_release(conf, STOCKFISH_RELEASES, filename)
+        # Keep the hash if continuing on the same engine
+        if self.engine is not p:
+            send(p, "ucinewgame")
+            isready(p)
+            self.engine = p
 
+    def step(self, p):
+        ply = self.next_ply
 
-def is_user_site_package():
-    try:
-        user_site = site.getusersitepackages()
-    except AttributeError:
-        return False
+        if ply in self.resolved:
+            part = go(p, self.job["position"], self.moves[0:ply],
+                      nodes=min(self.profile["nodes"] or TABLEBASE_NODES, TABLEBASE_NODES))
+        else:
+            part = go(p, self.job["position"], self.moves[0:ply],
+                      nodes=self.profile["nodes"],
+                      movetime=self.profile["movetime"],
+                      depth=self.profile["depth"])
 
-    return os.path.abspath(__file__).startswith(os.path.join(user_site, ""))
+            if "mate" not in part["score"] and "time" in part and part["time"] < 100:
+                logging.warning("Very low time reported: %d ms.", part["time"])
 
+        if "nps" in part and part["nps"] >= 100000000:
+            logging.warning("Dropping exorbitant nps: %d", part["nps"])
+            del part["nps"]
 
-def update_self(force=False):
-    # Ensure current instance is installed as a package
-    if __package__ is None:
-        raise ConfigError("Not started as a package (python -m). Can not update using pip")
+        # The expected reply is only used to ponder after move jobs
+        part.pop("ponder", None)
 
-    if all(dirname not in ["site-packages", "dist-packages"] for dirname in __file__.split(os.sep)):
-        raise ConfigError("Not installed as package (%s). Can not update using pip" % __file__)
+        self.plies[ply] = PlyInfo.from_info(part)
+        self.next_ply = ply - 1
+        return part
 
-    logging.debug("Package: \"%s\", name: %s, loader: %s",
-                  __package__, __name__, __loader__)
 
-    # Ensure pip is available
-    try:
-        import pip
-    except ImportError:
-        raise ConfigError("Auto update enabled, but pip not installed")
+class Tablebase(object):
+    # Probes Syzygy tables in the client (with python-chess), to find plies
+    # of a game that need only a short search. Engines use the same tables,
+    # memory mapped and thus shared by all processes.
 
-    # Check pip is up to date
-    pip_up_to_date = LooseVersion(pip.__version__) >= LooseVersion("8.0.0")
-    if pip_up_to_date:
-        logging.debug("using pip %s", pip.__version__)
-    else:
-        logging.warning("using pip %s < 8.0.0", pip.__version__)
+    def __init__(self, syzygy_path):
+        import chess
+        import chess.syzygy
+
+        self.chess = chess
+        self.tables = chess.syzygy.Tablebase()
+        self.pieces = 0
+        for directory in syzygy_path.split(os.pathsep):
+            self.tables.add_directory(directory)
+            self.pieces = max(self.pieces, syzygy_pieces(directory))
+
+        # Held while probing, so that the tables are not closed under a
+        # worker after a reload
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def resolved_plies(self, job):
+        variant = job.get("variant", "standard").lower()
+        if variant not in ["standard", "fromposition", "chess960"] or not self.pieces:
+            return set()
+
+        resolved = set()
+        try:
+            board = self.chess.Board(job.get("position", STARTPOS), chess960=variant == "chess960")
+        except ValueError:
+            return resolved
+
+        with self.lock:
+            if self.closed:
+                return resolved
+
+            for ply, move in enumerate([move for move in job["moves"].split(" ") if move] + [None]):
+                if len(board.piece_map()) <= self.pieces and not board.castling_rights:
+                    try:
+                        self.tables.probe_wdl(board)
+                        resolved.add(ply)
+                    except KeyError:
+                        # Missing table
+                        pass
+
+                if move is not None:
+                    try:
+                        board.push_uci(move)
+                    except ValueError:
+                        # Leave the rest to the engine
+                        break
+
+        return resolved
+
+    def close(self):
+        # Waits for probing workers
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.tables.close()
+
+
+def syzygy_pieces(directory):
+    # Largest number of pieces of the WDL tables in a directory
+    pieces = 0
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == ".rtbw":
+            pieces = max(pieces, len(stem.replace("v", "")))
+    return pieces
+
+
+def open_tablebase(conf):
+    syzygy_path = get_syzygy_path(conf)
+    if not syzygy_path:
+        return None
+
+    try:
+        return Tablebase(syzygy_path)
+    except ImportError:
+        logging.warning("Probing tablebases in the client requires python-chess "
+                        "(try pip install python-chess)")
+        return None
+
+
+@contextlib.contextmanager
+def startup_phase(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = STARTUP_TIMINGS.get(name, 0.0) + time.time() - start
+
+
+class StartupCache(object):
+    # Persists results of expensive startup checks (CPU detection, engine
+    # validation) across restarts. Entries are keyed by everything they
+    # depend on, so stale entries are simply never hit.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.data = {}
+
+    def get(self, section, key):
+        with self.lock:
+            return self.data.get(section, {}).get(key)
+
+    def set(self, section, key, value):
+        with self.lock:
+            self.data.setdefault(section, {})[key] = value
+
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.data, f, indent=2, sort_keys=True)
+                replace_file(tmp_path, self.path)
+            except (IOError, OSError):
+                logging.debug("Could not write startup cache %s", self.path)
+
+
+# Shared by all workers of the process
+STARTUP_CACHES = {}
+STARTUP_CACHES_LOCK = threading.Lock()
+STOCKFISH_OPTIONS = {}
+STOCKFISH_OPTIONS_LOCK = threading.Lock()
+
+
+def get_startup_cache(conf):
+    path = os.path.join(get_engine_dir(conf), STARTUP_CACHE)
+    with STARTUP_CACHES_LOCK:
+        if path not in STARTUP_CACHES:
+            STARTUP_CACHES[path] = StartupCache(path)
+        return STARTUP_CACHES[path]
+
+
+def read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def hugepages_available(meminfo_path="/proc/meminfo",
+                        thp_path="/sys/kernel/mm/transparent_hugepage/enabled"):
+    # Stockfish falls back to normal pages if large pages can not be used
+    if os.name == "nt":
+        return True
+
+    try:
+        with open(meminfo_path) as meminfo:
+            for line in meminfo:
+                if line.startswith("HugePages_Free:") and int(line.split()[1]) > 0:
+                    return True
+    except (IOError, OSError, ValueError):
+        pass
+
+    thp = read_first_line(thp_path) or ""
+    return "[always]" in thp or "[madvise]" in thp
+
+
+def cgroup_dirs(controller, root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    # Directories of the cgroup of this process and its ancestors, with a
+    # single hierarchy (cgroup v2) or a hierarchy per controller (cgroup v1).
+    # In containers the own cgroup is usually mounted as the root.
+    paths = {}
+    try:
+        with open(proc_cgroup) as f:
+            for line in f:
+                parts = line.strip().split(":", 2)
+                if len(parts) == 3:
+                    for name in parts[1].split(","):
+                        paths[name] = parts[2]
+    except (IOError, OSError):
+        pass
+
+    if os.path.isfile(os.path.join(root, "cgroup.controllers")):
+        base, path = root, paths.get("", "/")
+    else:
+        try:
+            names = [name for name in sorted(os.listdir(root)) if controller in name.split(",")]
+        except OSError:
+            names = []
+        if not names:
+            return []
+        base, path = os.path.join(root, names[0]), paths.get(controller, "/")
+
+    dirs = []
+    path = path.strip("/")
+    while path:
+        if os.path.isdir(os.path.join(base, path)):
+            dirs.append(os.path.join(base, path))
+        path = os.path.dirname(path)
+    dirs.append(base)
+    return dirs
+
+
+def parse_cpuset(cpuset):
+    cpus = set()
+    for part in cpuset.split(","):
+        start, _, end = part.strip().partition("-")
+        if start:
+            cpus.update(range(int(start), int(end or start) + 1))
+    return len(cpus)
+
+
+def cgroup_cpus(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    # Number of CPUs usable according to the CPU quota and cpuset, or None
+    limit = None
+
+    for d in cgroup_dirs("cpu", root, proc_cgroup):
+        line = read_first_line(os.path.join(d, "cpu.max"))
+        if line:
+            quota, _, period = line.partition(" ")
+        else:
+            quota = read_first_line(os.path.join(d, "cpu.cfs_quota_us"))
+            period = read_first_line(os.path.join(d, "cpu.cfs_period_us"))
+
+        try:
+            quota, period = int(quota), int(period)
+        except (TypeError, ValueError):
+            # No quota (max or -1)
+            continue
+
+        if quota > 0 and period > 0:
+            cpus = max(1, quota // period)
+            limit = cpus if limit is None else min(limit, cpus)
+
+    for d in cgroup_dirs("cpuset", root, proc_cgroup):
+        for name in ["cpuset.cpus.effective", "cpuset.effective_cpus", "cpuset.cpus"]:
+            line = read_first_line(os.path.join(d, name))
+            if line:
+                try:
+                    cpus = parse_cpuset(line)
+                except ValueError:
+                    continue
+                return cpus if limit is None else min(limit, cpus)
+
+    return limit
+
+
+def cpu_count():
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Python 2, or not supported by the platform
+        count = multiprocessing.cpu_count()
+
+    limit = cgroup_cpus()
+    return count if limit is None else max(1, min(count, limit))
+
+
+def memory_limit(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    # Memory limit of the cgroup in MB, or None
+    limit = None
+
+    for d in cgroup_dirs("memory", root, proc_cgroup):
+        line = read_first_line(os.path.join(d, "memory.max")) or \
+            read_first_line(os.path.join(d, "memory.limit_in_bytes"))
+        try:
+            value = int(line)
+        except (TypeError, ValueError):
+            # No limit (max)
+            continue
+
+        # cgroup v1 reports no limit as a huge number
+        if 0 < value < 2 ** 60:
+            limit = value // (1024 * 1024) if limit is None else min(limit, value // (1024 * 1024))
+
+    return limit
+
+
+def cpu_model():
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    return "%s %s" % (platform.machine(), line.split(":", 1)[1].strip())
+    except IOError:
+        pass
+
+    return "%s %s %s" % (platform.machine(), platform.processor(), platform.node())
+
+
+def cpuid_key():
+    # CPU capabilities are detected by running this module with the current
+    # interpreter (see cmd_cpuid)
+    path = os.path.abspath(__file__)
+    try:
+        st = os.stat(path)
+        binary = "%s|%d|%d" % (path, st.st_mtime, st.st_size)
+    except OSError:
+        binary = path
+    return "%s|%s|%s" % (sys.executable, binary, cpu_model())
+
+
+def stockfish_binary(stockfish_command, engine_dir):
+    # Find the executable of a command, if it is a file
+    try:
+        executable = shlex.split(stockfish_command)[0]
+    except (ValueError, IndexError):
+        return None
+
+    path = os.path.join(engine_dir, os.path.expanduser(executable))
+    return path if os.path.isfile(path) else None
+
+
+def detect_cpu_capabilities():
+    # Detects support for popcnt and pext instructions
+    modern, bmi2 = False, False
+
+    # Run cpuid in subprocess for robustness in case of segfaults
+    cmd = []
+    cmd.append(sys.executable)
+    if __package__ is not None:
+        cmd.append("-m")
+        cmd.append(os.path.splitext(os.path.basename(__file__))[0])
+    else:
+        cmd.append(__file__)
+    cmd.append("cpuid")
+
+    process = open_process(cmd, shell=False)
+
+    # Parse output
+    while True:
+        line = process.reader.readline()
+        if line is None:
+            break
+
+        line = line.decode("utf-8", "replace").rstrip()
+        logging.debug("cpuid >> %s", line)
+        if not line:
+            continue
+
+        columns = line.split()
+        if columns[0] == "CPUID":
+            pass
+        elif len(columns) == 5 and all(all(c in string.hexdigits for c in col) for col in columns):
+            eax, a, b, c, d = [int(col, 16) for col in columns]
+
+            # popcnt
+            if eax == 1 and c & (1 << 23):
+                modern = True
+
+            # pext
+            if eax == 7 and b & (1 << 8):
+                bmi2 = True
+        else:
+            logging.warning("Unexpected cpuid output: %s", line)
+
+    # Done
+    process.wait()
+    if process.returncode != 0:
+        logging.error("cpuid exited with status code %d", process.returncode)
+
+    return modern, bmi2
+
+
+def stockfish_candidates(conf):
+    # All builds compatible with the CPU, most specific first
+    machine = platform.machine().lower()
+
+    cache = get_startup_cache(conf)
+    key = cpuid_key()
+    capabilities = cache.get("cpu", key)
+    if capabilities is None:
+        with startup_phase("cpuid"):
+            capabilities = detect_cpu_capabilities()
+        cache.set("cpu", key, capabilities)
+
+    modern, bmi2 = capabilities
+    if modern and bmi2:
+        suffixes = ["-bmi2", "-modern", ""]
+    elif modern:
+        suffixes = ["-modern", ""]
+    else:
+        suffixes = [""]
+
+    if os.name == "nt":
+        return ["stockfish-windows-%s%s.exe" % (machine, suffix) for suffix in suffixes]
+    elif os.name == "os2" or sys.platform == "darwin":
+        return ["stockfish-osx-%s" % machine]
+    elif os.name == "posix":
+        return ["stockfish-%s%s" % (machine, suffix) for suffix in suffixes]
+
+
+def stockfish_filename(conf, candidates=None):
+    # Pick the fastest of the available builds. pext is microcoded on some
+    # CPUs, so the most specific build is not always the fastest.
+    candidates = candidates or stockfish_candidates(conf)
+    engine_dir = get_engine_dir(conf)
+    available = [filename for filename in candidates
+                 if os.path.isfile(os.path.join(engine_dir, filename))]
+    if len(available) < 2:
+        return (available or candidates)[0]
+
+    # Benchmark again after engine updates
+    signature = []
+    for filename in available:
+        st = os.stat(os.path.join(engine_dir, filename))
+        signature.append("%s:%d:%d" % (filename, st.st_size, int(st.st_mtime)))
+    key = "%s %s" % (cpu_model(), " ".join(signature))
+
+    cache = get_startup_cache(conf)
+    selection = cache.get("build", key)
+    if selection is None:
+        with startup_phase("engine benchmark"):
+            nps = dict((filename, benchmark_stockfish(filename, engine_dir))
+                       for filename in available)
+        for filename in available:
+            logging.info("Benchmarked %s: %d nps", filename, nps[filename])
+
+        # Prefer the most specific build on ties
+        selection = {"filename": max(available, key=lambda filename: nps[filename]), "nps": nps}
+        cache.set("build", key, selection)
+        logging.info("Selected %s", selection["filename"])
+
+    return selection["filename"]
+
+
+def benchmark_stockfish(filename, engine_dir):
+    p = open_process(os.path.join(".", filename), engine_dir)
+    try:
+        uci(p)
+        setoption(p, "Threads", 1)
+        setoption(p, "Hash", HASH_MIN)
+        isready(p)
+
+        info = go(p, BENCH_POSITION, [], movetime=BENCH_MOVETIME)
+        send(p, "quit")
+        return info.get("nps") or int(info.get("nodes", 0) * 1000 / max(info.get("time", 1), 1))
+    except (EOFError, IOError, OSError):
+        logging.exception("Could not benchmark %s", filename)
+        return 0
+    finally:
+        kill_process(p)
+        p.wait()
+
+
+def replace_file(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mirror_location(mirror, name):
+    if mirror.startswith(("http://", "https://")):
+        return urlparse.urljoin(mirror if mirror.endswith("/") else mirror + "/", name)
+    else:
+        return os.path.join(mirror, name)
+
+
+def lookup_release(conf, release_page):
+    # Release metadata is looked up at most every RELEASE_CHECK_INTERVAL,
+    # from the mirror (a copy of the release JSON as release.json) if any
+    mirror = get_engine_mirror(conf)
+    location = mirror_location(mirror, "release.json") if mirror else release_page
+
+    cache = get_startup_cache(conf)
+    cached = cache.get("release", location)
+    if cached and time.time() - cached["checked"] < RELEASE_CHECK_INTERVAL:
+        return cached["release"]
+
+    logging.info("Looking up latest release at %s ...", location)
+
+    etag = None
+    if not location.startswith(("http://", "https://")):
+        with open(location) as f:
+            data = json.load(f)
+    else:
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+
+        # Escape GitHub API rate limiting
+        if "GITHUB_API_TOKEN" in os.environ and not mirror:
+            headers["Authorization"] = "token %s" % os.environ["GITHUB_API_TOKEN"]
+
+        with http("GET", location, headers=headers) as response:
+            if response.status == 304:
+                data = None
+            else:
+                data = json.loads(response.read().decode("utf-8"))
+                etag = response.getheader("ETag")
+
+    if data is None:
+        release, etag = cached["release"], cached["etag"]
+    else:
+        release = {
+            "tag_name": data["tag_name"],
+            "published_at": data.get("published_at"),
+            "assets": {},
+        }
+        for asset in data["assets"]:
+            digest = asset.get("digest") or ""
+            release["assets"][asset["name"]] = {
+                "url": (mirror_location(mirror, asset["name"]) if mirror
+                        else asset["browser_download_url"]),
+                "size": asset.get("size"),
+                "sha256": digest[len("sha256:"):] if digest.startswith("sha256:") else None,
+            }
+
+    cache.set("release", location, {"checked": time.time(), "etag": etag, "release": release})
+    return release
+
+
+def download(url, path, size=None):
+    # Download to path, resuming a previous partial download
+    if not url.startswith(("http://", "https://")):
+        shutil.copyfile(url, path)
+        return
+
+    offset = os.path.getsize(path) if os.path.isfile(path) else 0
+    if size is not None and offset >= size:
+        if offset == size:
+            return
+        offset = 0
+
+    for _ in range(MAX_REDIRECTS):
+        headers = {"Range": "bytes=%d-" % offset} if offset else {}
+        with http("GET", url, headers=headers) as response:
+            if response.status in [301, 302, 303, 307, 308]:
+                url = urlparse.urljoin(url, response.getheader("Location"))
+                response.read()
+                continue
+
+            if response.status == 206:
+                logging.info("Resuming download at %d bytes", offset)
+            else:
+                offset = 0
+
+            total = offset + int(response.getheader("Content-Length") or 0)
+            with open(path, "ab" if offset else "wb") as f:
+                while True:
+                    chunk = response.read(DOWNLOAD_CHUNK)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    offset += len(chunk)
+
+                    if sys.stderr.isatty() and total:
+                        sys.stderr.write("\rDownloading %s: %d/%d (%d%%)" % (
+                                             os.path.basename(urlparse.urlparse(url).path),
+                                             offset, total, round(offset * 100 / total)))
+                        sys.stderr.flush()
+
+            if sys.stderr.isatty() and total:
+                sys.stderr.write("\n")
+                sys.stderr.flush()
+            return
+
+    raise IOError("Too many redirects: %s" % url)
+
+
+def fetch_artifact(conf, name, asset):
+    # Artifacts are stored by their SHA-256, so that they can be shared by
+    # all engine directories (and hosts) using the same EngineCache
+    store = get_engine_cache(conf)
+    cache = get_startup_cache(conf)
+
+    sha256 = asset["sha256"] or cache.get("artifact", asset["url"])
+    if sha256 and os.path.isfile(os.path.join(store, sha256)):
+        logging.info("Found %s in %s", name, store)
+        return os.path.join(store, sha256)
+
+    stem = sha256 or hashlib.sha256(asset["url"].encode("utf-8")).hexdigest()
+    part = os.path.join(store, "%s.part" % stem)
+    logging.info("Downloading %s ...", asset["url"])
+    download(asset["url"], part, asset["size"])
+
+    digest = sha256_file(part)
+    if (asset["size"] is not None and os.path.getsize(part) != asset["size"]) or \
+            (sha256 and digest != sha256):
+        os.remove(part)
+        raise IOError("Download of %s is corrupt (expected sha256 %s, got %s)" %
+                      (name, sha256, digest))
+
+    path = os.path.join(store, digest)
+    replace_file(part, path)
+    cache.set("artifact", asset["url"], digest)
+    return path
+
+
+def download_github_release(conf, release_page, filenames):
+    engine_dir = get_engine_dir(conf)
+    paths = [os.path.join(engine_dir, filename) for filename in filenames]
+    logging.info("Engine target path: %s", paths[0])
+
+    try:
+        release = lookup_release(conf, release_page)
+    except (IOError, OSError, ValueError, HttpError) as err:
+        # Do not stall restarts. Alternative builds may be missing.
+        installed = [filename for filename, path in zip(filenames, paths) if os.path.isfile(path)]
+        if installed:
+            logging.warning("Could not look up release (%s). Using installed %s",
+                            err, ", ".join(installed))
+            return installed
+        raise
+
+    assets = release["assets"]
+    if filenames[0] not in assets:
+        raise ConfigError("No precompiled %s for your platform" % filenames[0])
+
+    try:
+        published = calendar.timegm(time.strptime(release["published_at"], "%Y-%m-%dT%H:%M:%SZ"))
+    except (TypeError, ValueError):
+        published = None
+
+    cache = get_startup_cache(conf)
+    installed = []
+    for filename, path in zip(filenames, paths):
+        # Alternative builds are optional
+        if filename not in assets:
+            logging.warning("No precompiled %s in release", filename)
+            continue
+
+        if os.path.isfile(path):
+            if cache.get("engine", filename) == release["tag_name"]:
+                logging.debug("%s is up to date (%s)", filename, release["tag_name"])
+                installed.append(filename)
+                continue
+            elif published is not None and os.path.getmtime(path) > published and \
+                    cache.get("engine", filename) is None:
+                logging.info("Local %s is newer than release", filename)
+                installed.append(filename)
+                continue
+
+        logging.info("Latest release is tagged %s", release["tag_name"])
+        artifact = fetch_artifact(conf, filename, assets[filename])
+
+        # Install atomically and make executable
+        logging.info("Installing %s", filename)
+        shutil.copyfile(artifact, path + ".tmp")
+        st = os.stat(path + ".tmp")
+        os.chmod(path + ".tmp", st.st_mode | stat.S_IEXEC)
+        replace_file(path + ".tmp", path)
+
+        cache.set("engine", filename, release["tag_name"])
+        installed.append(filename)
+
+    return installed
+
+
+def update_stockfish(conf, filenames):
+    return download_github_release(conf, STOCKFISH_RELEASES, filenames)
+
+
+def is_user_site_package():
+    try:
+        user_site = site.getusersitepackages()
+    except AttributeError:
+        return False
+
+    return os.path.abspath(__file__).startswith(os.path.join(user_site, ""))
+
+
+def update_self(force=False):
+    # Ensure current instance is installed as a package
+    if __package__ is None:
+        raise ConfigError("Not started as a package (python -m). Can not update using pip")
+
+    if all(dirname not in ["site-packages", "dist-packages"] for dirname in __file__.split(os.sep)):
+        raise ConfigError("Not installed as package (%s). Can not update using pip" % __file__)
+
+    logging.debug("Package: \"%s\", name: %s, loader: %s",
+                  __package__, __name__, __loader__)
+
+    # Ensure pip is available
+    try:
+        import pip
+    except ImportError:
+        raise ConfigError("Auto update enabled, but pip not installed")
+
+    # Check pip is up to date
+    pip_up_to_date = LooseVersion(pip.__version__) >= LooseVersion("8.0.0")
+    if pip_up_to_date:
+        logging.debug("using pip %s", pip.__version__)
+    else:
+        logging.warning("using pip %s < 8.0.0", pip.__version__)
 
     # Ensure module file is going to be writable
     try:
@@ -1106,6 +2506,10 @@ def load_conf(args):
         conf.set("Fishnet", "EngineDir", args.engine_dir)
     if hasattr(args, "stockfish_command") and args.stockfish_command is not None:
         conf.set("Fishnet", "StockfishCommand", args.stockfish_command)
+    if hasattr(args, "engine_cache") and args.engine_cache is not None:
+        conf.set("Fishnet", "EngineCache", args.engine_cache)
+    if hasattr(args, "engine_mirror") and args.engine_mirror is not None:
+        conf.set("Fishnet", "EngineMirror", args.engine_mirror)
     if hasattr(args, "key") and args.key is not None:
         conf.set("Fishnet", "Key", args.key)
     if hasattr(args, "cores") and args.cores is not None:
@@ -1118,10 +2522,30 @@ def load_conf(args):
         conf.set("Fishnet", "Endpoint", args.endpoint)
     if hasattr(args, "fixed_backoff") and args.fixed_backoff is not None:
         conf.set("Fishnet", "FixedBackoff", str(args.fixed_backoff))
+    if hasattr(args, "load_control") and args.load_control is not None:
+        conf.set("Fishnet", "LoadControl", str(args.load_control))
+    if hasattr(args, "large_pages") and args.large_pages is not None:
+        conf.set("Fishnet", "LargePages", args.large_pages)
+    if hasattr(args, "long_poll") and args.long_poll is not None:
+        conf.set("Fishnet", "LongPoll", str(args.long_poll))
+    if hasattr(args, "move_workers") and args.move_workers is not None:
+        conf.set("Fishnet", "MoveWorkers", str(args.move_workers))
+    if hasattr(args, "light_level") and args.light_level is not None:
+        conf.set("Fishnet", "LightLevel", str(args.light_level))
+    if hasattr(args, "ponder") and args.ponder is not None:
+        conf.set("Fishnet", "Ponder", str(args.ponder))
+    if hasattr(args, "syzygy_path") and args.syzygy_path is not None:
+        conf.set("Fishnet", "SyzygyPath", args.syzygy_path)
+    if hasattr(args, "coordinator") and args.coordinator is not None:
+        conf.set("Fishnet", "Coordinator", args.coordinator)
+    if hasattr(args, "coordinator_token") and args.coordinator_token is not None:
+        conf.set("Fishnet", "CoordinatorToken", args.coordinator_token)
+    if hasattr(args, "control_socket") and args.control_socket is not None:
+        conf.set("Fishnet", "ControlSocket", args.control_socket)
     for option_name, option_value in args.setoption:
         conf.set("Stockfish", option_name.lower(), option_value)
 
-    logging.getLogger().addFilter(CensorLogFilter(conf_get(conf, "Key")))
+    censor(conf_get(conf, "Key"))
 
     return conf
 
@@ -1194,17 +2618,18 @@ def configure(args):
     print(file=out)
 
     # Cores
-    max_cores = multiprocessing.cpu_count()
+    max_cores = cpu_count()
     default_cores = max(1, max_cores - 1)
-    cores = config_input("Number of cores to use for engine threads (default %d, max %d): " % (default_cores, max_cores),
-                         validate_cores, out)
+    cores = config_input("Number of cores to use for engine threads (default %d, max %d): " %
+                         (default_cores, max_cores), validate_cores, out)
     conf.set("Fishnet", "Cores", str(cores))
 
     # Advanced options
     endpoint = args.endpoint or DEFAULT_ENDPOINT
     fixed_backoff = False
     if config_input("Configure advanced options? (default: no) ", parse_bool, out):
-        endpoint = config_input("Fishnet API endpoint (default: %s): " % (endpoint, ), validate_endpoint, out)
+        endpoint = config_input("Fishnet API endpoint (default: %s): " % (endpoint, ),
+                                validate_endpoint, out)
 
     conf.set("Fishnet", "Endpoint", endpoint)
 
@@ -1220,7 +2645,7 @@ def configure(args):
         key = config_input("Personal fishnet key (append ! to force, %s): " % status,
                            lambda v: validate_key(v, conf, network=True), out)
     conf.set("Fishnet", "Key", key)
-    logging.getLogger().addFilter(CensorLogFilter(key))
+    censor(key)
 
     # Confirm
     print(file=out)
@@ -1248,19 +2673,45 @@ def validate_engine_dir(engine_dir):
     return engine_dir
 
 
+def validate_engine_cache(engine_cache, conf):
+    if not engine_cache or not engine_cache.strip():
+        engine_cache = os.path.join(get_engine_dir(conf), ARTIFACT_CACHE)
+    else:
+        engine_cache = os.path.abspath(os.path.expanduser(engine_cache.strip()))
+
+    if not os.path.isdir(engine_cache):
+        try:
+            os.makedirs(engine_cache)
+        except OSError:
+            raise ConfigError("Could not create EngineCache: %s" % engine_cache)
+
+    return engine_cache
+
+
+def validate_engine_mirror(engine_mirror):
+    if not engine_mirror or not engine_mirror.strip():
+        return None
+
+    engine_mirror = engine_mirror.strip()
+    if engine_mirror.startswith(("http://", "https://")):
+        return engine_mirror
+
+    engine_mirror = os.path.abspath(os.path.expanduser(engine_mirror))
+    if not os.path.isdir(engine_mirror):
+        raise ConfigError("EngineMirror must be an http(s) URL or a directory: %s" % engine_mirror)
+
+    return engine_mirror
+
+
 def validate_stockfish_command(stockfish_command, conf):
-    if not stockfish_command or not stockfish_command.strip() or stockfish_command.strip().lower() == "download":
+    if not stockfish_command or not stockfish_command.strip() or \
+            stockfish_command.strip().lower() == "download":
         return None
 
     stockfish_command = stockfish_command.strip()
-    engine_dir = get_engine_dir(conf)
 
     # Ensure the required options are supported
-    process = open_process(stockfish_command, engine_dir)
-    _, options = uci(process)
-    kill_process(process)
-
-    logging.debug("Supported options: %s", ", ".join(options))
+    options = stockfish_options(stockfish_command, conf)
 
     required_options = set(["Threads", "Hash", "UCI_Chess960", "UCI_Variant"])
     missing_options = required_options.difference(options)
@@ -1271,6 +2722,40 @@ def validate_stockfish_command(stockfish_command, conf):
     return stockfish_command
 
 
+def stockfish_options(stockfish_command, conf):
+    engine_dir = get_engine_dir(conf)
+
+    # Validation results remain valid as long as the binary is unchanged
+    binary = stockfish_binary(stockfish_command, engine_dir)
+    if binary:
+        st = os.stat(binary)
+        key = "%s|%s|%d|%d|%s" % (engine_dir, stockfish_command,
+                                  st.st_mtime, st.st_size, cpu_model())
+    else:
+        key = "%s|%s" % (engine_dir, stockfish_command)
+
+    # Workers starting in parallel wait for a single validation
+    with STOCKFISH_OPTIONS_LOCK:
+        if key in STOCKFISH_OPTIONS:
+            return STOCKFISH_OPTIONS[key]
+
+        cache = get_startup_cache(conf) if binary else None
+        options = cache.get("engines", key) if cache else None
+        if options is None:
+            with startup_phase("engine validation"):
+                process = open_process(stockfish_command, engine_dir)
+                _, options = uci(process)
+                kill_process(process)
+
+            logging.debug("Supported options: %s", ", ".join(options))
+            options = sorted(options)
+            if cache:
+                cache.set("engines", key, options)
+
+        STOCKFISH_OPTIONS[key] = set(options)
+        return STOCKFISH_OPTIONS[key]
+
+
 def parse_bool(inp, default=False):
     if not inp:
         return default
@@ -1288,11 +2773,13 @@ def parse_bool(inp, default=False):
 
 
 def validate_cores(cores):
+    max_cores = cpu_count()
+
     if not cores or cores.strip().lower() == "auto":
-        return max(1, multiprocessing.cpu_count() - 1)
+        return max(1, max_cores - 1)
 
     if cores.strip().lower() == "all":
-        return multiprocessing.cpu_count()
+        return max_cores
 
     try:
         cores = int(cores.strip())
@@ -1302,8 +2789,8 @@ def validate_cores(cores):
     if cores < 1:
         raise ConfigError("Need at least one core")
 
-    if cores > multiprocessing.cpu_count():
-        raise ConfigError("At most %d cores available on your machine " % multiprocessing.cpu_count())
+    if cores > max_cores:
+        raise ConfigError("At most %d cores available on your machine " % max_cores)
 
     return cores
 
@@ -1328,28 +2815,101 @@ def validate_threads(threads, conf):
     return threads
 
 
+def validate_move_workers(move_workers, conf):
+    cores = validate_cores(conf_get(conf, "Cores"))
+
+    if not move_workers or not str(move_workers).strip():
+        return 0
+
+    try:
+        move_workers = int(str(move_workers).strip())
+    except ValueError:
+        raise ConfigError("Number of move workers must be an integer")
+
+    if move_workers < 0:
+        raise ConfigError("Number of move workers can not be negative")
+
+    if move_workers >= cores:
+        raise ConfigError("%d cores is not enough to reserve %d for move workers" %
+                          (cores, move_workers))
+
+    return move_workers
+
+
+def validate_light_level(light_level):
+    if light_level is None or not str(light_level).strip():
+        return LIGHT_LEVEL
+
+    try:
+        light_level = int(str(light_level).strip())
+    except ValueError:
+        raise ConfigError("LightLevel must be an integer")
+
+    if not 0 <= light_level <= len(LVL_MOVETIMES):
+        raise ConfigError("LightLevel must be between 0 and %d" % len(LVL_MOVETIMES))
+
+    return light_level
+
+
 def validate_memory(memory, conf):
+    # Total hash of all engines, including HASH_MIN for each move engine
     cores = validate_cores(conf_get(conf, "Cores"))
     threads = validate_threads(conf_get(conf, "Threads"), conf)
-    processes = cores // threads
+    move_workers = validate_move_workers(conf_get(conf, "MoveWorkers"), conf)
+    processes = max(1, (cores - move_workers) // threads)
+    reserved = move_workers * HASH_MIN
+
+    # Leave room for the engine processes in the cgroup
+    limit = memory_limit()
 
     if not memory or not memory.strip() or memory.strip().lower() == "auto":
-        return processes * HASH_DEFAULT
+        if limit is not None:
+            return reserved + max(processes * HASH_MIN,
+                                  min(processes * HASH_DEFAULT, limit // 2 - reserved))
+        return reserved + processes * HASH_DEFAULT
 
     try:
         memory = int(memory.strip())
     except ValueError:
         raise ConfigError("Memory must be an integer")
 
-    if memory < processes * HASH_MIN:
-        raise ConfigError("Not enough memory for a minimum of %d x %d MB in hash tables" % (processes, HASH_MIN))
+    if limit is not None and memory > limit:
+        raise ConfigError("Only %d MB of memory available" % limit)
+
+    if memory < reserved + processes * HASH_MIN:
+        raise ConfigError("Not enough memory for a minimum of %d x %d MB in hash tables" %
+                          (processes + move_workers, HASH_MIN))
 
-    if memory > processes * HASH_MAX:
-        raise ConfigError("Can not reasonably use more than %d x %d MB = %d MB for hash tables" % (processes, HASH_MAX, processes * HASH_MAX))
+    if memory > reserved + processes * HASH_MAX:
+        raise ConfigError("Can not reasonably use more than %d x %d MB = %d MB for hash tables" %
+                          (processes, HASH_MAX, reserved + processes * HASH_MAX))
 
     return memory
 
 
+def validate_syzygy_path(syzygy_path):
+    if not syzygy_path or not syzygy_path.strip():
+        return None
+
+    directories = []
+    for directory in syzygy_path.split(os.pathsep):
+        if directory.strip():
+            directory = os.path.abspath(os.path.expanduser(directory.strip()))
+            if not os.path.isdir(directory):
+                raise ConfigError("SyzygyPath not found: %s" % directory)
+            directories.append(directory)
+
+    return os.pathsep.join(directories) or None
+
+
+def validate_large_pages(large_pages):
+    if not large_pages or not str(large_pages).strip() or \
+            str(large_pages).strip().lower() == "auto":
+        return hugepages_available()
+
+    return parse_bool(large_pages)
+
+
 def validate_endpoint(endpoint):
     if not endpoint or not endpoint.strip():
         return DEFAULT_ENDPOINT
@@ -1364,70 +2924,623 @@ def validate_endpoint(endpoint):
     return endpoint
 
 
+def validate_long_poll(long_poll):
+    if not long_poll or not str(long_poll).strip():
+        return 0
+
+    try:
+        long_poll = int(str(long_poll).strip())
+    except ValueError:
+        raise ConfigError("LongPoll must be an integer number of seconds")
+
+    if long_poll < 0:
+        raise ConfigError("LongPoll can not be negative")
+
+    if long_poll > MAX_LONG_POLL:
+        raise ConfigError("LongPoll can be at most %d seconds" % MAX_LONG_POLL)
+
+    return long_poll
+
+
+def validate_address(address):
+    # host:port of a coordinator, or None. IPv6 addresses with a port are
+    # written in brackets.
+    if not address or not address.strip():
+        return None
+
+    address = address.strip()
+    if address.startswith("["):
+        host, _, port = address[1:].partition("]")
+        if port and not port.startswith(":"):
+            raise ConfigError("Invalid coordinator address: %s" % address)
+        port = port[1:]
+    elif address.count(":") > 1:
+        host, port = address, ""
+    else:
+        host, _, port = address.rpartition(":")
+        if not host:
+            host, port = port, ""
+
+    if not host:
+        raise ConfigError("Invalid coordinator address: %s" % address)
+
+    try:
+        port = int(port) if port else COORDINATOR_PORT
+    except ValueError:
+        raise ConfigError("Coordinator port must be an integer")
+
+    if not 0 < port < 65536:
+        raise ConfigError("Coordinator port must be between 1 and 65535")
+
+    return host, port
+
+
+def format_address(address):
+    host, port = address
+    return ("[%s]:%d" if ":" in host else "%s:%d") % (host, port)
+
+
+def is_loopback(host):
+    return host == "localhost" or host.startswith("127.") or host == "::1"
+
+
+def validate_control_socket(path):
+    # Path of the Unix socket for fishnet ctl, or None
+    if not path or not path.strip():
+        return None
+
+    if not hasattr(socket, "AF_UNIX"):
+        raise ConfigError("ControlSocket requires Unix domain sockets, "
+                          "which are not available on this platform")
+
+    path = os.path.abspath(os.path.expanduser(path.strip()))
+    if not os.path.isdir(os.path.dirname(path)):
+        raise ConfigError("Directory for ControlSocket not found: %s" % os.path.dirname(path))
+
+    return path
+
+
+def validate_analysis_profile(conf, offline=False):
+    # Default search limits for analysis from the [Analysis] section
+    profile = {}
+    for key in sorted(ANALYSIS_DEFAULTS):
+        value = conf_get(conf, key, section="Analysis")
+        if value is None or not value.strip():
+            continue
+
+        if value.strip().lower() == "none" and key != "multipv":
+            profile[key] = None
+            continue
+
+        try:
+            profile[key] = int(value.strip())
+        except ValueError:
+            raise ConfigError("Analysis %s must be an integer" % key)
+
+        if profile[key] < 1:
+            raise ConfigError("Analysis %s must be positive" % key)
+
+    if profile.get("multipv", 1) > MAX_MULTIPV:
+        raise ConfigError("Analysis multipv can be at most %d" % MAX_MULTIPV)
+
+    # Otherwise searches would never end
+    limits = dict(ANALYSIS_DEFAULTS)
+    limits.update(profile)
+    if all(limits[key] is None for key in ["nodes", "movetime", "depth"]):
+        raise ConfigError("Analysis needs at least one of nodes, movetime or depth")
+
+    if profile and not offline and is_production_endpoint(conf):
+        raise ConfigError("Custom analysis profiles are only supported for private endpoints")
+
+    return profile
+
+
 def validate_key(key, conf, network=False):
     if not key or not key.strip():
         if is_production_endpoint(conf):
             raise ConfigError("Fishnet key required")
         else:
-            return ""
+            return ""
+
+    key = key.strip()
+
+    network = network and not key.endswith("!")
+    key = key.rstrip("!").strip()
+
+    if not re.match(r"^[a-zA-Z0-9]+$", key):
+        raise ConfigError("Fishnet key is expected to be alphanumeric")
+
+    if network:
+        try:
+            with http("GET", get_endpoint(conf, "key/%s" % key)) as response:
+                response.read()
+        except HttpClientError as error:
+            if error.status == 404:
+                raise ConfigError("Invalid or inactive fishnet key")
+            else:
+                raise
+
+    return key
+
+
+def conf_get(conf, key, default=None, section="Fishnet"):
+    if not conf.has_section(section):
+        return default
+    elif not conf.has_option(section, key):
+        return default
+    else:
+        return conf.get(section, key)
+
+
+def get_engine_dir(conf):
+    return validate_engine_dir(conf_get(conf, "EngineDir"))
+
+
+def get_stockfish_command(conf, update=True):
+    stockfish_command = validate_stockfish_command(conf_get(conf, "StockfishCommand"), conf)
+    if not stockfish_command:
+        candidates = stockfish_candidates(conf)
+        if update:
+            with startup_phase("engine update"):
+                candidates = update_stockfish(conf, candidates)
+        filename = stockfish_filename(conf, candidates)
+        return validate_stockfish_command(os.path.join(".", filename), conf)
+    else:
+        return stockfish_command
+
+
+def get_engine_cache(conf):
+    return validate_engine_cache(conf_get(conf, "EngineCache"), conf)
+
+
+def get_engine_mirror(conf):
+    return validate_engine_mirror(conf_get(conf, "EngineMirror"))
+
+
+def get_syzygy_path(conf):
+    return validate_syzygy_path(conf_get(conf, "SyzygyPath"))
+
+
+def get_large_pages(conf):
+    return validate_large_pages(conf_get(conf, "LargePages"))
+
+
+def get_endpoint(conf, sub=""):
+    return urlparse.urljoin(validate_endpoint(conf_get(conf, "Endpoint")), sub)
+
+
+def get_long_poll(conf):
+    return validate_long_poll(conf_get(conf, "LongPoll"))
+
+
+def is_production_endpoint(conf):
+    endpoint = validate_endpoint(conf_get(conf, "Endpoint"))
+    hostname = urlparse.urlparse(endpoint).hostname
+    return hostname == "lichess.org" or hostname.endswith(".lichess.org")
+
+
+def get_key(conf):
+    return validate_key(conf_get(conf, "Key"), conf, network=False)
+
+
+def get_coordinator(conf):
+    return validate_address(conf_get(conf, "Coordinator"))
+
+
+def get_coordinator_token(conf):
+    token = conf_get(conf, "CoordinatorToken")
+    return token.strip() if token and token.strip() else None
+
+
+def get_control_socket(conf):
+    return validate_control_socket(conf_get(conf, "ControlSocket"))
+
+
+def distribute_cores(cores, instances):
+    buckets = [0] * instances
+    for i in range(0, cores):
+        buckets[i % instances] += 1
+    return buckets
+
+
+def worker_layout(conf):
+    # (threads, hash) of the analysis and move workers
+    cores = validate_cores(conf_get(conf, "Cores"))
+    move_workers = validate_move_workers(conf_get(conf, "MoveWorkers"), conf)
+    threads = validate_threads(conf_get(conf, "Threads"), conf)
+    instances = max(1, (cores - move_workers) // threads)
+    memory = validate_memory(conf_get(conf, "Memory"), conf) - move_workers * HASH_MIN
+
+    analysis = [(bucket, memory // instances)
+                for bucket in distribute_cores(cores - move_workers, instances)]
+    return analysis, [(1, HASH_MIN)] * move_workers
+
+
+def percentile(sorted_values, p):
+    index = int(math.ceil(p / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+Settings = collections.namedtuple("Settings", [
+    "endpoint", "base_url", "key", "long_poll", "fishnet_info", "analysis",
+    "light_level", "ponder", "tablebase",
+])
+
+
+class LoadController(object):
+    # Parks workers while the host is busy with other work and resumes them
+    # when there is room again, at most one decision per CONTROL_INTERVAL.
+    # Decisions are based on CPU pressure stall information if available,
+    # otherwise on the load average (which includes our own engines).
+
+    def __init__(self, workers, proc_root="/proc"):
+        self.workers = workers
+        self.proc_root = proc_root
+        self.capacity = cpu_count()
+
+        self.pressure = None
+        self.load = None
+        self.parks = 0
+        self.resumes = 0
+
+    def sample(self):
+        self.pressure = None
+        line = read_first_line(os.path.join(self.proc_root, "pressure", "cpu"))
+        if line and line.startswith("some"):
+            for field in line.split()[1:]:
+                name, _, value = field.partition("=")
+                if name == "avg10":
+                    self.pressure = float(value)
+
+        line = read_first_line(os.path.join(self.proc_root, "loadavg"))
+        self.load = float(line.split()[0]) if line else None
+
+    def control(self):
+        self.sample()
+
+        active = [worker for worker in self.workers if worker.active.is_set()]
+        parked = [worker for worker in self.workers if not worker.active.is_set()]
+
+        if self.pressure is not None:
+            overloaded = self.pressure > PRESSURE_HIGH
+            idle = self.pressure < PRESSURE_LOW
+        elif self.load is not None:
+            overloaded = self.load > self.capacity + 0.5
+            idle = bool(parked) and self.load + parked[0].threads < self.capacity
+        else:
+            return
+
+        # Keep at least one worker running
+        if overloaded and len(active) > 1:
+            worker = active[-1]
+            worker.park()
+            self.parks += 1
+            logging.info("Host is busy (cpu pressure %s, load %0.2f). Parking %s",
+                         "n/a" if self.pressure is None else "%0.1f%%" % self.pressure,
+                         self.load or 0.0, worker.name)
+        elif idle and parked:
+            worker = parked[0]
+            worker.unpark()
+            self.resumes += 1
+            logging.info("Host has room (cpu pressure %s, load %0.2f). Resuming %s",
+                         "n/a" if self.pressure is None else "%0.1f%%" % self.pressure,
+                         self.load or 0.0, worker.name)
+
+    def run(self):
+        while True:
+            time.sleep(CONTROL_INTERVAL)
+            try:
+                self.control()
+            except Exception:
+                logging.exception("Load control failed. Continuing.")
+
+
+class WorkerPool(object):
+    # Workers of fishnet run. Capacity can be changed at runtime via the
+    # control socket: workers are resized and retired at job boundaries,
+    # so that no work is aborted.
+
+    def __init__(self, args, conf, settings, broker=None):
+        self.args = args
+        self.conf = conf
+        self.settings = settings
+        self.broker = broker
+
+        # Small engines for move jobs have their own acquisition loop
+        self.governor = Governor(conf)
+        self.move_governor = Governor(conf)
+        self.controller = None
+
+        self.lock = threading.RLock()
+        self.workers = collections.OrderedDict()
+
+        # Paused via the control socket, and thus left alone by the load
+        # controller until resumed
+        self.paused = set()
+
+    def add(self, threads, memory, lane=None):
+        with self.lock:
+            if lane:
+                worker = Worker(self.conf, threads, memory, self.move_governor, lane=lane,
+                                settings=self.settings, broker=self.broker)
+            else:
+                worker = Worker(self.conf, threads, memory, self.governor,
+                                settings=self.settings, broker=self.broker,
+                                light=self.move_governor)
+
+            number = len(self.workers) + 1
+            worker.name = "><> %d" % number
+            if worker.lane:
+                worker.name += " (%s)" % worker.lane
+            worker.daemon = True
+            worker.start()
+
+            self.workers[number] = worker
+            if self.controller and not lane:
+                self.controller.workers.append(worker)
+            return worker
+
+    def running(self):
+        with self.lock:
+            return [worker for worker in self.workers.values()
+                    if not worker.retiring or not worker.finished.is_set()]
+
+    def find(self, number):
+        with self.lock:
+            worker = self.workers.get(int(number)) if str(number).isdigit() else None
+        if not worker or worker.retiring:
+            raise ConfigError("No such worker: %s" % number)
+        return worker
+
+    def retire(self, worker):
+        with self.lock:
+            # Someone has to continue suspended analysis and handed off moves
+            if not any(other.lane == worker.lane and not other.retiring
+                       for other in self.workers.values() if other is not worker):
+                raise ConfigError("Can not remove the last %s worker" % (worker.lane or "analysis"))
+
+            if self.controller and worker in self.controller.workers:
+                self.controller.workers.remove(worker)
+            self.paused.discard(worker)
+            worker.retire()
+
+    def pause(self, worker):
+        with self.lock:
+            if self.controller and worker in self.controller.workers:
+                self.controller.workers.remove(worker)
+            self.paused.add(worker)
+            worker.park()
+
+    def resume(self, worker):
+        with self.lock:
+            if self.controller and not worker.lane and worker not in self.controller.workers:
+                self.controller.workers.append(worker)
+            self.paused.discard(worker)
+            worker.unpark()
+
+    def scale(self, lane, layout):
+        # Resize, add or retire workers of a lane to match the layout
+        workers = [worker for worker in self.running()
+                   if worker.lane == lane and not worker.retiring]
+        for worker, (threads, memory) in zip(workers, layout):
+            if (worker.threads, worker.memory) != (threads, memory):
+                worker.request_resize(threads, memory)
+        for threads, memory in layout[len(workers):]:
+            self.add(threads, memory, lane)
+        for worker in workers[len(layout):]:
+            try:
+                self.retire(worker)
+            except ConfigError as err:
+                logging.warning("%s. Keeping %s", err, worker.name)
+
+    def reload(self):
+        conf = load_conf(self.args)
+        settings = load_settings(conf)
+        analysis, move = worker_layout(conf)
+
+        with self.lock:
+            self.conf = conf
+            previous, self.settings = self.settings, settings
+            for worker in self.running():
+                worker.conf = conf
+                worker.settings = settings
+
+            self.scale(None, analysis)
+            self.scale("move", move)
+
+        close_settings(previous)
+
+        logging.info("Reloaded configuration: %d analysis and %d move workers",
+                     len(analysis), len(move))
+
+    def status(self):
+        status = []
+        with self.lock:
+            workers = list(self.workers.items())
+
+        for number, worker in workers:
+            if worker.finished.is_set():
+                state = "stopped"
+            elif worker.retiring:
+                state = "retiring"
+            elif worker in self.paused:
+                state = "paused"
+            elif not worker.active.is_set():
+                state = "parked"
+            elif worker.job:
+                state = "working"
+            else:
+                state = "idle"
+
+            job = worker.job
+            status.append({
+                "worker": number,
+                "lane": worker.lane,
+                "state": state,
+                "threads": worker.threads,
+                "hash": worker.hash,
+                "resize": worker.resize,
+                "job": job["work"]["id"] if job else None,
+                "type": job["work"]["type"] if job else None,
+                "positions": worker.positions,
+                "nodes": worker.nodes,
+                "moves": worker.moves,
+            })
+        return status
+
+    def control(self, message):
+        # Commands of fishnet ctl
+        command = message["command"]
+        values = message.get("args") or []
+
+        if command == "status":
+            return {"workers": self.status()}
+        elif command in ["pause", "resume"]:
+            workers = [self.find(value) for value in values] or \
+                [w for w in self.running() if not w.retiring]
+            for worker in workers:
+                if command == "pause":
+                    self.pause(worker)
+                else:
+                    self.resume(worker)
+            action = "Paused" if command == "pause" else "Resumed"
+            return {"message": "%s %d workers" % (action, len(workers))}
+        elif command == "add":
+            if values and values[0] == "move":
+                worker = self.add(1, HASH_MIN, "move")
+            else:
+                threads, memory = validate_resize(values)
+                worker = self.add(threads, memory)
+            return {"message": "Added %s" % worker.name}
+        elif command == "remove":
+            if not values:
+                raise ConfigError("Usage: remove WORKER...")
+            for value in values:
+                self.retire(self.find(value))
+            return {"message": "Retiring %d workers at the next job boundary" % len(values)}
+        elif command == "resize":
+            if not values:
+                raise ConfigError("Usage: resize WORKER THREADS [HASH]")
+            worker = self.find(values[0])
+            threads, memory = validate_resize(values[1:], worker.memory)
+            worker.request_resize(threads, memory)
+            return {"message": "Resizing %s at the next job boundary" % worker.name}
+        elif command == "reload":
+            self.reload()
+            return {"message": "Reloaded configuration"}
+        else:
+            raise ConfigError("Unknown command: %s (try status, pause, resume, "
+                              "add, remove, resize or reload)" % command)
 
-    key = key.strip()
 
-    network = network and not key.endswith("!")
-    key = key.rstrip("!").strip()
+def validate_resize(values, memory=HASH_DEFAULT):
+    # THREADS [HASH] of a control command
+    if not values:
+        raise ConfigError("Need number of threads")
 
-    if not re.match(r"^[a-zA-Z0-9]+$", key):
-        raise ConfigError("Fishnet key is expected to be alphanumeric")
+    try:
+        threads = int(values[0])
+        memory = int(values[1]) if len(values) > 1 else memory
+    except ValueError:
+        raise ConfigError("Threads and hash must be integers")
 
-    if network:
-        try:
-            with http("GET", get_endpoint(conf, "key/%s" % key)) as response:
-                response.read()
-        except HttpClientError as error:
-            if error.status == 404:
-                raise ConfigError("Invalid or inactive fishnet key")
-            else:
-                raise
+    if not 1 <= threads <= cpu_count():
+        raise ConfigError("Threads must be between 1 and %d" % cpu_count())
+    if memory < HASH_MIN:
+        raise ConfigError("Hash must be at least %d MB" % HASH_MIN)
 
-    return key
+    limit = memory_limit()
+    if limit is not None and memory > limit:
+        raise ConfigError("Only %d MB of memory available" % limit)
 
+    return threads, memory
 
-def conf_get(conf, key, default=None, section="Fishnet"):
-    if not conf.has_section(section):
-        return default
-    elif not conf.has_option(section, key):
-        return default
-    else:
-        return conf.get(section, key)
 
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
 
-def get_engine_dir(conf):
-    return validate_engine_dir(conf_get(conf, "EngineDir"))
+            try:
+                response = self.server.pool.control(json.loads(line.decode("utf-8")))
+            except (ValueError, KeyError):
+                logging.warning("Invalid control message: %r", line)
+                break
+            except ConfigError as err:
+                response = {"error": str(err)}
+            except Exception as err:
+                logging.exception("Failed to handle control message")
+                response = {"error": str(err)}
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    # Like socketserver.UnixStreamServer, which does not exist on all
+    # platforms
+    address_family = getattr(socket, "AF_UNIX", None)
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        # Replace the socket of a previous run, unless it is still in use
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            probe = socket.socket(self.address_family, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except socket.error:
+                os.remove(path)
+            else:
+                raise ConfigError("Control socket %s is in use by another instance" % path)
+            finally:
+                probe.close()
 
+        # Only the owner may connect
+        umask = os.umask(0o077)
+        try:
+            socketserver.TCPServer.__init__(self, path, ControlRequestHandler)
+        finally:
+            os.umask(umask)
 
-def get_stockfish_command(conf, update=True):
-    stockfish_command = validate_stockfish_command(conf_get(conf, "StockfishCommand"), conf)
-    if not stockfish_command:
-        filename = stockfish_filename()
-        if update:
-            filename = update_stockfish(conf, filename)
-        return validate_stockfish_command(os.path.join(".", filename), conf)
-    else:
-        return stockfish_command
+        self.path = path
+        self.pool = pool
 
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
 
-def get_endpoint(conf, sub=""):
-    return urlparse.urljoin(validate_endpoint(conf_get(conf, "Endpoint")), sub)
 
+def load_settings(conf, offline=False):
+    # Validate settings used on the hot path only once
+    endpoint = "" if offline else get_endpoint(conf)
 
-def is_production_endpoint(conf):
-    endpoint = validate_endpoint(conf_get(conf, "Endpoint"))
-    hostname = urlparse.urlparse(endpoint).hostname
-    return hostname == "lichess.org" or hostname.endswith(".lichess.org")
+    # Agents of a coordinator use its key
+    key = "" if offline or get_coordinator(conf) else get_key(conf)
+    return Settings(
+        endpoint=endpoint,
+        base_url=base_url(endpoint) if endpoint else "",
+        key=key,
+        long_poll=get_long_poll(conf),
+        fishnet_info=(
+            ("version", __version__),
+            ("python", platform.python_version()),
+            ("apikey", key),
+        ),
+        analysis=validate_analysis_profile(conf, offline),
+        light_level=validate_light_level(conf_get(conf, "LightLevel")),
+        ponder=parse_bool(conf_get(conf, "Ponder")),
+        tablebase=open_tablebase(conf))
 
 
-def get_key(conf):
-    return validate_key(conf_get(conf, "Key"), conf, network=False)
+def close_settings(settings):
+    # Release resources opened by load_settings
+    if settings.tablebase:
+        settings.tablebase.close()
 
 
 def start_backoff(conf):
@@ -1465,7 +3578,9 @@ def update_available():
 
 
 def cmd_run(args):
+    # Settings used on the hot path are validated once, with the config
     conf = load_conf(args)
+    settings = load_settings(conf)
 
     if args.auto_update:
         print()
@@ -1485,20 +3600,45 @@ def cmd_run(args):
     print()
     print("EngineDir:        %s" % get_engine_dir(conf))
     print("StockfishCommand: %s" % stockfish_command)
-    print("Key:              %s" % (("*" * len(get_key(conf))) or "(none)"))
+    syzygy_path = get_syzygy_path(conf)
+    if syzygy_path:
+        print("SyzygyPath:       %s" % syzygy_path)
+    coordinator = get_coordinator(conf)
+    if not coordinator:
+        print("Key:              %s" % (("*" * len(get_key(conf))) or "(none)"))
 
     cores = validate_cores(conf_get(conf, "Cores"))
     print("Cores:            %d" % cores)
 
+    move_workers = validate_move_workers(conf_get(conf, "MoveWorkers"), conf)
     threads = validate_threads(conf_get(conf, "Threads"), conf)
-    instances = max(1, cores // threads)
+    instances = max(1, (cores - move_workers) // threads)
     print("Engine processes: %d (each ~%d threads)" % (instances, threads))
+    if move_workers:
+        print("Move engines:     %d (each 1 thread, %d MB)" % (move_workers, HASH_MIN))
+        light_level = validate_light_level(conf_get(conf, "LightLevel"))
+        print("LightLevel:       %s" %
+              (("up to %d on move engines" % light_level) if light_level else "no"))
     memory = validate_memory(conf_get(conf, "Memory"), conf)
-    print("Memory:           %d MB" % memory)
-    endpoint = get_endpoint(conf)
-    warning = "" if endpoint.startswith("https://") else " (WARNING: not using https)"
-    print("Endpoint:         %s%s" % (endpoint, warning))
+    print("Memory:           %d MB (%d MB per engine process)" %
+          (memory, (memory - move_workers * HASH_MIN) // instances))
+    print("LargePages:       %s" %
+          ("yes, if supported by the engine" if get_large_pages(conf) else "no"))
+    if coordinator:
+        print("Coordinator:      %s" % format_address(coordinator))
+    else:
+        endpoint = get_endpoint(conf)
+        warning = "" if endpoint.startswith("https://") else " (WARNING: not using https)"
+        print("Endpoint:         %s%s" % (endpoint, warning))
     print("FixedBackoff:     %s" % parse_bool(conf_get(conf, "FixedBackoff")))
+    load_control = parse_bool(conf_get(conf, "LoadControl"))
+    print("LoadControl:      %s" % load_control)
+    print("Ponder:           %s" % parse_bool(conf_get(conf, "Ponder")))
+    long_poll = get_long_poll(conf)
+    print("LongPoll:         %s" % (("%ds" % long_poll) if long_poll else "no"))
+    control_socket = get_control_socket(conf)
+    if control_socket:
+        print("ControlSocket:    %s" % control_socket)
     print()
 
     if conf.has_section("Stockfish") and conf.items("Stockfish"):
@@ -1513,20 +3653,43 @@ def cmd_run(args):
             print(" * %s = %s%s" % (name, value, hint))
         print()
 
+    logging.debug("Startup took %0.3fs so far (%s)", time.time() - STARTUP,
+                  ", ".join("%s: %0.3fs" % timing for timing in STARTUP_TIMINGS.items()) or
+                  "all cached")
+
     print("### Starting workers ...")
     print()
 
-    buckets = [0] * instances
-    for i in range(0, cores):
-        buckets[i % instances] += 1
-
-    workers = [Worker(conf, bucket, memory // instances) for bucket in buckets]
-
-    # Start all threads
-    for i, worker in enumerate(workers):
-        worker.name = "><> %d" % (i + 1)
-        worker.setDaemon(True)
-        worker.start()
+    # Exchange jobs with the coordinator instead of the server
+    broker = CoordinatorBroker(coordinator, get_coordinator_token(conf)) if coordinator else None
+
+    # Reserve small engines with their own acquisition loop for move jobs.
+    # Big engines pass low levels to them, if they are idle.
+    pool = WorkerPool(args, conf, settings, broker)
+    governor, move_governor = pool.governor, pool.move_governor
+    analysis, move = worker_layout(conf)
+    for threads, hash_size in analysis:
+        pool.add(threads, hash_size)
+    for threads, hash_size in move:
+        pool.add(threads, hash_size, "move")
+    workers = pool.running()
+
+    # Adapt the number of analysis workers to the load of the host
+    controller = None
+    if load_control:
+        controller = LoadController([worker for worker in workers if not worker.lane])
+        pool.controller = controller
+        thread = threading.Thread(target=controller.run, name="load control")
+        thread.daemon = True
+        thread.start()
+
+    # Let fishnet ctl change capacity at runtime
+    server = None
+    if control_socket:
+        server = ControlServer(control_socket, pool)
+        thread = threading.Thread(target=server.serve_forever, name="control")
+        thread.daemon = True
+        thread.start()
 
     # Wait while the workers are running
     try:
@@ -1534,19 +3697,83 @@ def cmd_run(args):
         handler = SignalHandler()
         handler.install()
 
+        all_ready = False
         while True:
             # Check worker status
+            workers = pool.running()
             for worker in workers:
                 worker.finished.wait(STAT_INTERVAL / len(workers))
                 if worker.fatal_error:
                     raise worker.fatal_error
 
+            if not all_ready and all(worker.ready.is_set() for worker in workers):
+                all_ready = True
+                logging.info("All %d engines ready after %0.1fs", len(workers),
+                             max(worker.ready_time for worker in workers) - STARTUP)
+
             # Log stats
             logging.info("[fishnet v%s] Analyzed %d positions, crunched %d million nodes",
                          __version__,
                          sum(worker.positions for worker in workers),
                          int(sum(worker.nodes for worker in workers) / 1000 / 1000))
 
+            time_waiting = sum(worker.time_waiting for worker in workers)
+            time_working = sum(worker.time_working for worker in workers)
+            logging.info("Workers spent %0.1fs working and %0.1fs waiting for jobs "
+                         "(%d%% busy, backoff pressure %0.2f)",
+                         time_working, time_waiting,
+                         round(100 * time_working / max(time_working + time_waiting, 0.001)),
+                         governor.pressure)
+
+            if controller:
+                logging.info("Load control: %d of %d workers active "
+                             "(parked %d, resumed %d times, %0.1fs parked), "
+                             "cpu pressure %s, load %s",
+                             sum(1 for worker in controller.workers if worker.active.is_set()),
+                             len(controller.workers), controller.parks, controller.resumes,
+                             sum(worker.time_parked for worker in workers),
+                             "n/a" if controller.pressure is None
+                             else "%0.1f%%" % controller.pressure,
+                             "n/a" if controller.load is None else "%0.2f" % controller.load)
+
+            big = [worker for worker in workers if not worker.lane]
+            small = [worker for worker in workers if worker.lane]
+            if big and small:
+                logging.info("Move jobs (total): %d on move engines (%d threads), "
+                             "%d on big engines (%d threads), %d handed off",
+                             sum(worker.moves for worker in small),
+                             sum(worker.threads for worker in small),
+                             sum(worker.moves for worker in big),
+                             sum(worker.threads for worker in big),
+                             move_governor.handed_off)
+
+            jobs = sum(worker.variant_hits + worker.variant_switches for worker in workers)
+            if jobs:
+                switches = sum(worker.variant_switches for worker in workers)
+                switch_time = sum(worker.variant_switch_time for worker in workers)
+                logging.info("Engine setup: same game %d%%, same variant %d%%, "
+                             "routed %d by game and %d by variant, ~%0.1fs saved",
+                             round(100 * sum(worker.game_hits for worker in workers) / jobs),
+                             round(100 * (jobs - switches) / jobs),
+                             governor.routed["game"] + move_governor.routed["game"],
+                             governor.routed["variant"] + move_governor.routed["variant"],
+                             (jobs - switches) * switch_time / max(switches, 1))
+
+            if settings.ponder:
+                logging.info("Pondered %d times, "
+                             "%d followed by a move job for the expected position",
+                             sum(worker.ponder_searches for worker in workers),
+                             sum(worker.ponder_hits for worker in workers))
+
+            move_latencies = sorted(latency for worker in workers
+                                    for latency in list(worker.move_latencies))
+            if move_latencies:
+                logging.info("Move latency: p50 %0.3fs, p90 %0.3fs, p99 %0.3fs (%d samples)",
+                             percentile(move_latencies, 50),
+                             percentile(move_latencies, 90),
+                             percentile(move_latencies, 99),
+                             len(move_latencies))
+
             # Check for update
             if random.random() <= CHECK_PYPI_CHANCE and update_available() and args.auto_update:
                 raise UpdateRequired()
@@ -1564,7 +3791,12 @@ def cmd_run(args):
     finally:
         handler.ignore = True
 
+        if server:
+            server.shutdown()
+            server.server_close()
+
         # Stop workers
+        workers = pool.running()
         for worker in workers:
             worker.stop()
 
@@ -1572,6 +3804,779 @@ def cmd_run(args):
         for worker in workers:
             worker.finished.wait()
 
+        # Abort suspended analysis and moves that were not yet played
+        for worker in workers:
+            task = worker.governor.resume()
+            while task:
+                worker.job = task.job
+                worker.abort_job()
+                task = worker.governor.resume()
+
+            worker.job = worker.governor.take_handoff()
+            while worker.job:
+                worker.abort_job()
+                worker.job = worker.governor.take_handoff()
+
+        close_settings(pool.settings)
+
+    return 0
+
+
+class JsonlSink(object):
+    # One JSON line per game
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, job, result):
+        self.f.write(json.dumps({
+            "game_id": job["game_id"],
+            "work_id": job["work"]["id"],
+            "analysis": result["analysis"],
+        }))
+        self.f.write("\n")
+        self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+class PackedSink(object):
+    # Binary records, readable without parsing JSON. Games and plies start
+    # with a fixed size header (GAME, 8 bytes and PLY, 35 bytes), followed by
+    # variable length strings, so records have to be read sequentially:
+    #
+    # Game: magic "FNG1", uint32 plies, uint16 length + game id (UTF-8),
+    #       uint16 length + work id (UTF-8), then each ply.
+    # Ply:  uint16 ply, uint16 depth, uint16 seldepth, uint64 nodes,
+    #       uint32 nps, uint32 time (ms), uint64 tbhits, uint8 score kind
+    #       (0 none, 1 cp, 2 mate), int32 score, uint16 length + pv (UTF-8)
+    #
+    # Integers are little endian and unaligned. Missing values are 0.
+
+    GAME = struct.Struct("<4sI")
+    PLY = struct.Struct("<HHHQIIQBi")
+
+    def __init__(self, f):
+        self.f = f
+
+    def write_string(self, value):
+        data = value.encode("utf-8")
+        self.f.write(struct.pack("<H", len(data)))
+        self.f.write(data)
+
+    def write(self, job, result):
+        self.f.write(self.GAME.pack(b"FNG1", len(result["analysis"])))
+        self.write_string(job["game_id"] or "")
+        self.write_string(job["work"]["id"])
+
+        for ply, part in enumerate(result["analysis"]):
+            part = part or {}
+            score = part.get("score", {})
+            if "cp" in score:
+                kind, value = 1, score["cp"]
+            elif "mate" in score:
+                kind, value = 2, score["mate"]
+            else:
+                kind, value = 0, 0
+
+            self.f.write(self.PLY.pack(
+                ply, part.get("depth", 0), part.get("seldepth", 0),
+                part.get("nodes", 0), part.get("nps", 0), part.get("time", 0),
+                part.get("tbhits", 0), kind, value))
+            self.write_string(part.get("pv", ""))
+
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetSink(object):
+    # One row per ply, written in row groups to bound memory usage
+
+    COLUMNS = ["game_id", "work_id", "ply", "depth", "seldepth", "nodes",
+               "nps", "time", "tbhits", "cp", "mate", "pv"]
+
+    def __init__(self, path, batch_size=10000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ConfigError("Writing Parquet requires pyarrow (try pip install pyarrow)")
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([
+            ("game_id", pyarrow.string()),
+            ("work_id", pyarrow.string()),
+            ("ply", pyarrow.uint16()),
+            ("depth", pyarrow.uint16()),
+            ("seldepth", pyarrow.uint16()),
+            ("nodes", pyarrow.uint64()),
+            ("nps", pyarrow.uint32()),
+            ("time", pyarrow.uint32()),
+            ("tbhits", pyarrow.uint64()),
+            ("cp", pyarrow.int32()),
+            ("mate", pyarrow.int32()),
+            ("pv", pyarrow.string()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.columns = dict((column, []) for column in self.COLUMNS)
+        self.rows = 0
+
+    def write(self, job, result):
+        for ply, part in enumerate(result["analysis"]):
+            part = part or {}
+            score = part.get("score", {})
+            row = [job["game_id"], job["work"]["id"], ply,
+                   part.get("depth"), part.get("seldepth"), part.get("nodes"),
+                   part.get("nps"), part.get("time"), part.get("tbhits"),
+                   score.get("cp"), score.get("mate"), part.get("pv")]
+            for column, value in zip(self.COLUMNS, row):
+                self.columns[column].append(value)
+            self.rows += 1
+
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pydict(self.columns, schema=self.schema))
+            self.columns = dict((column, []) for column in self.COLUMNS)
+            self.rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_sink(path, output_format=None):
+    if not output_format:
+        if path.endswith(".gz"):
+            output_format = "jsonl.gz"
+        elif path.endswith(".parquet"):
+            output_format = "parquet"
+        elif path.endswith(".bin"):
+            output_format = "packed"
+        else:
+            output_format = "jsonl"
+
+    if output_format == "jsonl":
+        return JsonlSink(sys.stdout if path == "-" else open(path, "w"))
+    elif output_format == "jsonl.gz":
+        if path == "-":
+            raise ConfigError("Compressed output needs an output file")
+        return JsonlSink(gzip.open(path, "wt" if sys.version_info[0] >= 3 else "wb"))
+    elif output_format == "packed":
+        if path == "-":
+            raise ConfigError("Packed output needs an output file")
+        return PackedSink(open(path, "wb"))
+    elif output_format == "parquet":
+        if path == "-":
+            raise ConfigError("Parquet output needs an output file")
+        return ParquetSink(path)
+    else:
+        raise ConfigError("Unknown output format: %s" % output_format)
+
+
+class BatchBroker(object):
+    # Hands out jobs from a local source to workers and writes the results,
+    # in place of the fishnet server
+
+    def __init__(self, jobs, sink):
+        self.jobs = jobs
+        self.sink = sink
+        self.lock = threading.Lock()
+        self.games = 0
+        self.failed = 0
+
+    def exchange(self, worker, path, request):
+        if path.startswith("analysis/"):
+            self.write(worker.job, request)
+
+        with self.lock:
+            for job in self.jobs:
+                if job is not None:
+                    return job
+                self.failed += 1
+
+            worker.stop()
+            return None
+
+    def write(self, job, result):
+        with self.lock:
+            self.sink.write(job, result)
+            self.games += 1
+
+    def abort(self, worker, job):
+        logging.error("Failed to analyse game %s", job["game_id"])
+        with self.lock:
+            self.failed += 1
+
+    def progress(self, worker, job, result):
+        return True
+
+
+def read_jobs(f, filename):
+    # Streams analysis jobs from JSONL (fishnet jobs or games) or PGN.
+    # Invalid entries are logged and yielded as None, to be counted as
+    # failed.
+    if filename.lower().endswith(".pgn"):
+        games = read_pgn_games(f)
+    else:
+        games = (line for line in f if line.strip())
+
+    for i, game in enumerate(games):
+        try:
+            yield parse_job(game, i + 1)
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            logging.error("Skipping game %d of %s: %s: %s",
+                          i + 1, filename, type(err).__name__, err)
+            yield None
+
+
+def parse_job(game, number):
+    if not isinstance(game, dict):
+        game = json.loads(game)
+
+    if "work" in game:
+        if game["work"]["type"] != "analysis":
+            raise ValueError("Only analysis jobs are supported, got %s" % game["work"]["type"])
+        game["moves"] = game["moves"].strip()
+        return game
+
+    work_id = str(game.get("id", number))
+    return {
+        "work": {
+            "type": "analysis",
+            "id": work_id,
+        },
+        "game_id": game.get("game_id", work_id),
+        "variant": game.get("variant", "standard"),
+        "position": game.get("position", STARTPOS),
+        "moves": game["moves"].strip(),
+    }
+
+
+def read_pgn_games(f):
+    try:
+        import chess.pgn
+    except ImportError:
+        raise ConfigError("Reading PGNs requires python-chess (try pip install python-chess)")
+
+    while True:
+        game = chess.pgn.read_game(f)
+        if game is None:
+            break
+
+        board = game.board()
+        try:
+            moves = [move.uci() for move in game.mainline_moves()]
+        except AttributeError:
+            # python-chess < 0.24
+            moves = [move.uci() for move in game.main_line()]
+        variant = game.headers.get("Variant", "standard").lower()
+        if variant.startswith("chess960") or variant == "fischerandom":
+            variant = "chess960"
+        elif variant not in ["standard", "chess"]:
+            logging.warning("Skipping unsupported PGN variant: %s", variant)
+            continue
+        elif game.headers.get("FEN"):
+            variant = "fromposition"
+
+        yield {
+            "game_id": game.headers.get("Site", "").rstrip("/").split("/")[-1] or None,
+            "variant": variant,
+            "position": board.fen(),
+            "moves": " ".join(moves),
+        }
+
+
+def cmd_analyse(args):
+    if not args.file:
+        raise ConfigError("Usage: fishnet analyse FILE")
+
+    # A configuration file is optional for offline analysis
+    if not args.conf and not os.path.isfile(DEFAULT_CONFIG):
+        args.no_conf = True
+    conf = load_conf(args)
+
+    stockfish_command = get_stockfish_command(conf)
+
+    # Same layout as run, but without engines reserved for move jobs
+    conf.set("Fishnet", "MoveWorkers", "0")
+    layout, _ = worker_layout(conf)
+    threads = validate_threads(conf_get(conf, "Threads"), conf)
+
+    logging.info("Analysing %s with %d engine processes (%s, each ~%d threads, %d MB)",
+                 args.file, len(layout), stockfish_command, threads, layout[0][1])
+
+    f = sys.stdin if args.file == "-" else open(args.file)
+    sink = open_sink(args.output or "-", args.output_format)
+
+    broker = BatchBroker(read_jobs(f, args.file), sink)
+    governor = Governor(conf)
+    settings = load_settings(conf, offline=True)
+    workers = [Worker(conf, bucket, memory, governor, settings=settings, broker=broker)
+               for bucket, memory in layout]
+
+    start = time.time()
+    for i, worker in enumerate(workers):
+        worker.name = "><> %d" % (i + 1)
+        worker.daemon = True
+        worker.start()
+
+    try:
+        handler = SignalHandler()
+        handler.install()
+
+        for worker in workers:
+            while not worker.finished.wait(STAT_INTERVAL):
+                logging.info("Analysed %d games, %d positions so far",
+                             broker.games, sum(w.positions for w in workers))
+            if worker.fatal_error:
+                raise worker.fatal_error
+    except Shutdown:
+        logging.info("\n\n### Good bye!")
+    finally:
+        handler.ignore = True
+
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.finished.wait()
+        close_settings(settings)
+
+        if f is not sys.stdin:
+            f.close()
+        sink.close()
+
+    end = time.time()
+    logging.info("Analysed %d games (%d failed), %d positions in %0.1fs",
+                 broker.games, broker.failed,
+                 sum(worker.positions for worker in workers), end - start)
+    return 65 if broker.failed else 0
+
+
+class CoordinatorBroker(object):
+    # Exchanges jobs and results with a fishnet coordinator instead of the
+    # server, using line delimited JSON. Each worker has its own connection.
+
+    def __init__(self, address, token=None):
+        self.address = address
+        self.token = token
+        self.local = threading.local()
+
+    def connect(self):
+        sock = socket.create_connection(self.address, HTTP_TIMEOUT + COORDINATOR_WAIT)
+        self.local.sock = sock
+        self.local.stream = sock.makefile("rwb")
+        return self.local.stream
+
+    def disconnect(self):
+        stream = getattr(self.local, "stream", None)
+        if stream is not None:
+            try:
+                stream.close()
+                self.local.sock.close()
+            except socket.error:
+                pass
+        self.local.stream = None
+
+    def roundtrip(self, stream, data):
+        stream.write(data)
+        stream.flush()
+        line = stream.readline()
+        if not line:
+            raise EOFError("Coordinator closed the connection")
+        return json.loads(line.decode("utf-8"))
+
+    def request(self, worker, message):
+        message["lane"] = worker.lane or ""
+        if self.token:
+            message["token"] = self.token
+        message["agent"] = {
+            "name": "%s %s" % (socket.gethostname(), worker.name),
+            "positions": worker.positions,
+            "nodes": worker.nodes,
+        }
+        data = json.dumps(message).encode("utf-8") + b"\n"
+
+        stream = getattr(self.local, "stream", None)
+        try:
+            response = self.roundtrip(stream or self.connect(), data)
+        except (socket.error, EOFError, ValueError) as err:
+            self.disconnect()
+            if stream is None:
+                raise HttpServerError(503, "Coordinator unavailable", str(err).encode("utf-8"))
+
+            # Stale connection. Try once more.
+            try:
+                response = self.roundtrip(self.connect(), data)
+            except (socket.error, EOFError, ValueError) as err:
+                self.disconnect()
+                raise HttpServerError(503, "Coordinator unavailable", str(err).encode("utf-8"))
+
+        # Errors of the server are passed through
+        if "status" in response:
+            error = HttpClientError if 400 <= response["status"] < 500 else HttpServerError
+            raise error(response["status"], response["reason"],
+                        response["body"].encode("utf-8"), response.get("retry_after"))
+
+        return response
+
+    def exchange(self, worker, path, request):
+        start = time.time()
+        job = self.request(worker, {"path": path, "request": request}).get("job")
+        if job:
+            worker.governor.got_job(worker)
+        else:
+            # The coordinator already held the request for a while
+            held = time.time() - start >= COORDINATOR_WAIT / 2
+            worker.governor.no_job(worker, backoff=not held)
+        return job
+
+    def abort(self, worker, job):
+        try:
+            self.request(worker, {
+                "path": "abort/%s" % job["work"]["id"],
+                "request": worker.make_request(),
+            })
+            logging.info("Aborted job %s", job["work"]["id"])
+        except Exception:
+            logging.exception("Could not abort job. Continuing.")
+
+    def progress(self, worker, job, result):
+        try:
+            self.request(worker, {
+                "path": "analysis/%s" % job["work"]["id"],
+                "request": result,
+                "progress": True,
+            })
+            return True
+        except Exception:
+            logging.exception("Could not send progress report. Continuing.")
+            return False
+
+
+class Coordinator(object):
+    # Serves jobs to agents (fishnet run --coordinator) on behalf of a
+    # private fleet, using a single key. Jobs are requested from the server
+    # only for waiting agents, with up to batch requests in flight. Results
+    # are forwarded with the key of the coordinator.
+
+    def __init__(self, conf, settings, batch, token=None):
+        self.conf = conf
+        self.settings = settings
+        self.batch = batch
+        self.token = token
+
+        # Backoff state, shared by the prefetch threads
+        self.governor = Governor(conf)
+
+        self.cond = threading.Condition()
+        self.alive = True
+        self.not_before = 0.0
+
+        # By lane
+        self.jobs = collections.defaultdict(collections.deque)
+        self.waiting = collections.Counter()
+        self.inflight = collections.Counter()
+
+        self.stockfish_info = None
+        self.agents = {}
+
+    def start(self):
+        for i in range(self.batch):
+            thread = threading.Thread(target=self.prefetch, name="coordinator %d" % (i + 1))
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.alive = False
+            self.cond.notify_all()
+            jobs = [job for lane in self.jobs for job in self.jobs[lane]]
+            self.jobs.clear()
+
+        for job in jobs:
+            try:
+                self.forward("abort/%s" % job["work"]["id"], self.make_request(), False)
+                logging.info("Aborted job %s", job["work"]["id"])
+            except Exception:
+                logging.exception("Could not abort job. Continuing.")
+
+    def make_request(self):
+        return {
+            "fishnet": dict(self.settings.fishnet_info),
+            "stockfish": self.stockfish_info,
+        }
+
+    def demand(self):
+        # Lane with agents that are not yet provided for, or None
+        for lane, waiting in self.waiting.items():
+            if waiting > len(self.jobs[lane]) + self.inflight[lane]:
+                return lane
+        return None
+
+    def take(self, lane, timeout):
+        deadline = time.time() + timeout
+        with self.cond:
+            self.waiting[lane] += 1
+            self.cond.notify_all()
+            try:
+                while not self.jobs[lane] and self.alive:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                return self.jobs[lane].popleft() if self.jobs[lane] else None
+            finally:
+                self.waiting[lane] -= 1
+
+    def prefetch(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.alive:
+                        return
+                    lane = self.demand()
+                    t = self.not_before - time.time()
+                    if lane is not None and t <= 0:
+                        break
+                    self.cond.wait(t if lane is not None else MAX_BACKOFF)
+                self.inflight[lane] += 1
+
+            job, held, t = None, False, None
+            try:
+                job, held, queue = self.acquire(lane)
+                if job:
+                    logging.debug("Got job for agents: %s", job["work"]["id"])
+                    self.governor.got_job(None, queue)
+                elif not held:
+                    t = self.governor.next_backoff()
+                    logging.debug("No job found. Backing off %0.1fs", t)
+            except HttpError as err:
+                if err.is_overload():
+                    t = self.governor.overloaded(err.retry_after)
+                else:
+                    t = self.governor.next_backoff()
+                logging.error("Server error: HTTP %d %s. Backing off %0.1fs",
+                              err.status, err.reason, t)
+            except Exception:
+                t = self.governor.next_backoff()
+                logging.exception("Backing off %0.1fs after exception in coordinator", t)
+
+            with self.cond:
+                self.inflight[lane] -= 1
+                if job:
+                    self.jobs[lane].append(job)
+                    self.cond.notify_all()
+                if t is not None:
+                    self.not_before = max(self.not_before, time.time() + t)
+
+    def acquire(self, lane):
+        # Returns the job, whether the server held the request, and the
+        # queue hint
+        long_poll = self.settings.long_poll
+        start = time.time()
+        with http("POST", self.settings.endpoint + acquire_path(long_poll, lane),
+                  json.dumps(self.make_request()), timeout=HTTP_TIMEOUT + long_poll) as response:
+            if response.status == 204:
+                return None, long_poll and time.time() - start >= long_poll / 2, None
+            else:
+                return json.loads(response.read().decode("utf-8")), True, parse_queue_hint(response)
+
+    def forward(self, path, request, expect_job=True):
+        request = dict(request, fishnet=dict(self.settings.fishnet_info))
+        with http("POST", self.settings.endpoint + path, json.dumps(request)) as response:
+            data = response.read().decode("utf-8")
+            if response.status == 204 or not expect_job:
+                return None
+            return json.loads(data)
+
+    def handle(self, message):
+        # Agents are not trusted beyond the token. They can only use the
+        # paths of the protocol, signed with the key of the coordinator.
+        if self.token and not hmac.compare_digest(str(message.get("token") or ""), self.token):
+            return {"status": 401, "reason": "Unauthorized",
+                    "body": json.dumps({"error": "Invalid coordinator token"})}
+
+        path = message["path"]
+        lane = message.get("lane") or ""
+        request = message.get("request") or {}
+        if not COORDINATOR_PATH.match(path) or lane not in ["", "move"] or \
+                not isinstance(request, dict):
+            return {"status": 403, "reason": "Forbidden",
+                    "body": json.dumps({"error": "Invalid request for %s" % path})}
+
+        agent = message.get("agent")
+        with self.cond:
+            if agent and agent.get("name"):
+                agent["seen"] = time.time()
+                self.agents[agent["name"]] = agent
+            if request.get("stockfish"):
+                self.stockfish_info = request["stockfish"]
+
+        try:
+            if path == "acquire":
+                job = self.take(lane, COORDINATOR_WAIT)
+            elif message.get("progress") or path.startswith("abort/"):
+                job = self.forward(path, request, False)
+            else:
+                # Submit the result. Continue with the next job assigned by
+                # the server or one from the buffer.
+                job = self.forward(path, request) or self.take(lane, 0)
+        except HttpError as err:
+            return {
+                "status": err.status,
+                "reason": err.reason,
+                "body": err.body.decode("utf-8", "replace"),
+                "retry_after": err.retry_after,
+            }
+
+        return {"job": job}
+
+    def stats(self):
+        with self.cond:
+            agents = list(self.agents.values())
+            buffered = sum(len(jobs) for jobs in self.jobs.values())
+        active = sum(1 for agent in agents if agent["seen"] > time.time() - STAT_INTERVAL)
+        positions = sum(agent.get("positions", 0) for agent in agents)
+        nodes = sum(agent.get("nodes", 0) for agent in agents)
+        return active, positions, nodes, buffered
+
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+
+            try:
+                response = self.server.coordinator.handle(json.loads(line.decode("utf-8")))
+            except (ValueError, KeyError):
+                logging.warning("Invalid message from %s:%d: %r",
+                                self.client_address[0], self.client_address[1], line)
+                break
+            except Exception:
+                logging.exception("Failed to handle message from %s:%d",
+                                  self.client_address[0], self.client_address[1])
+                response = {"status": 502, "reason": "Bad Gateway", "body": ""}
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class CoordinatorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coordinator):
+        if ":" in address[0]:
+            self.address_family = socket.AF_INET6
+        socketserver.TCPServer.__init__(self, address, CoordinatorRequestHandler)
+        self.coordinator = coordinator
+
+
+def cmd_coordinator(args):
+    conf = load_conf(args)
+    settings = load_settings(conf)
+    listen = validate_address(args.listen)
+    token = get_coordinator_token(conf)
+
+    # Otherwise anyone on the network could use the key
+    if not token and not is_loopback(listen[0]):
+        raise ConfigError("Listening on %s requires a CoordinatorToken (--coordinator-token), "
+                          "shared with the agents" % listen[0])
+
+    if args.batch < 1:
+        raise ConfigError("Batch must be at least 1")
+
+    print()
+    print("### Checking configuration ...")
+    print()
+    print("Key:              %s" % (("*" * len(settings.key)) or "(none)"))
+    warning = "" if settings.endpoint.startswith("https://") else " (WARNING: not using https)"
+    print("Endpoint:         %s%s" % (settings.endpoint, warning))
+    print("LongPoll:         %s" % (("%ds" % settings.long_poll) if settings.long_poll else "no"))
+    print("Listen:           %s" % format_address(listen))
+    print("Batch:            %d" % args.batch)
+    print()
+
+    coordinator = Coordinator(conf, settings, args.batch, token)
+    server = CoordinatorServer(listen, coordinator)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    coordinator.start()
+
+    logging.info("Waiting for agents on %s:%d", listen[0], listen[1])
+
+    try:
+        handler = SignalHandler()
+        handler.install()
+
+        while True:
+            time.sleep(STAT_INTERVAL)
+
+            active, positions, nodes, buffered = coordinator.stats()
+            logging.info("[fishnet v%s] %d agents analyzed %d positions, "
+                         "crunched %d million nodes (%d jobs buffered)",
+                         __version__, active, positions, int(nodes / 1000 / 1000), buffered)
+    except Shutdown:
+        logging.info("\n\n### Good bye!")
+    finally:
+        handler.ignore = True
+
+        server.shutdown()
+        server.server_close()
+        coordinator.stop()
+        close_settings(settings)
+
+    return 0
+
+
+def cmd_ctl(args):
+    # Only the control socket is needed. Do not start the configuration
+    # dialog.
+    if not args.conf and not os.path.isfile(DEFAULT_CONFIG):
+        args.no_conf = True
+    conf = load_conf(args)
+    path = get_control_socket(conf)
+    if not path:
+        raise ConfigError("Need --control-socket of the running client")
+
+    message = {"command": args.file or "status", "args": args.values}
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        response = json.loads(sock.makefile("rb").readline().decode("utf-8"))
+    except socket.error as err:
+        logging.error("Could not connect to %s: %s", path, err)
+        return 69
+    finally:
+        sock.close()
+
+    if "error" in response:
+        logging.error(response["error"])
+        return 1
+    elif "workers" in response:
+        print("worker  lane  state     threads  hash  job       positions  moves")
+        for worker in response["workers"]:
+            resize = " -> %d threads, %d MB" % tuple(worker["resize"]) if worker["resize"] else ""
+            print("%6d  %-4s  %-8s  %7d  %4s  %-8s  %9d  %5d%s" % (
+                worker["worker"], worker["lane"] or "", worker["state"], worker["threads"],
+                worker["hash"] or "-", worker["job"] or "-", worker["positions"], worker["moves"],
+                resize))
+    else:
+        print(response["message"])
+
     return 0
 
 
@@ -1630,6 +4635,12 @@ def cmd_systemd(args):
     if args.stockfish_command is not None:
         builder.append("--stockfish-command")
         builder.append(shell_quote(validate_stockfish_command(args.stockfish_command, conf)))
+    if args.engine_cache is not None:
+        builder.append("--engine-cache")
+        builder.append(shell_quote(validate_engine_cache(args.engine_cache, conf)))
+    if args.engine_mirror is not None:
+        builder.append("--engine-mirror")
+        builder.append(shell_quote(validate_engine_mirror(args.engine_mirror)))
     if args.cores is not None:
         builder.append("--cores")
         builder.append(shell_quote(str(validate_cores(args.cores))))
@@ -1644,6 +4655,34 @@ def cmd_systemd(args):
         builder.append(shell_quote(validate_endpoint(args.endpoint)))
     if args.fixed_backoff is not None:
         builder.append("--fixed-backoff" if args.fixed_backoff else "--no-fixed-backoff")
+    if args.load_control is not None:
+        builder.append("--load-control" if args.load_control else "--no-load-control")
+    if args.large_pages is not None:
+        builder.append("--large-pages")
+        builder.append(shell_quote(args.large_pages))
+    if args.long_poll is not None:
+        builder.append("--long-poll")
+        builder.append(shell_quote(str(validate_long_poll(args.long_poll))))
+    if args.move_workers is not None:
+        builder.append("--move-workers")
+        builder.append(shell_quote(str(validate_move_workers(args.move_workers, conf))))
+    if args.light_level is not None:
+        builder.append("--light-level")
+        builder.append(shell_quote(str(validate_light_level(args.light_level))))
+    if args.ponder is not None:
+        builder.append("--ponder" if args.ponder else "--no-ponder")
+    if args.syzygy_path is not None:
+        builder.append("--syzygy-path")
+        builder.append(shell_quote(validate_syzygy_path(args.syzygy_path)))
+    if args.coordinator is not None:
+        builder.append("--coordinator")
+        builder.append(shell_quote(format_address(validate_address(args.coordinator))))
+    if args.coordinator_token is not None:
+        builder.append("--coordinator-token")
+        builder.append(shell_quote(args.coordinator_token))
+    if args.control_socket is not None:
+        builder.append("--control-socket")
+        builder.append(shell_quote(validate_control_socket(args.control_socket)))
     for option_name, option_value in args.setoption:
         builder.append("--setoption")
         builder.append(shell_quote(option_name))
@@ -1676,7 +4715,8 @@ def cmd_systemd(args):
 
     if sys.stdout.isatty():
         print("\n# Example usage:", file=sys.stderr)
-        print("# python -m fishnet systemd | sudo tee /etc/systemd/system/fishnet.service", file=sys.stderr)
+        print("# python -m fishnet systemd | sudo tee /etc/systemd/system/fishnet.service",
+              file=sys.stderr)
         print("# sudo systemctl enable fishnet.service", file=sys.stderr)
         print("# sudo systemctl start fishnet.service", file=sys.stderr)
 
@@ -1832,42 +4872,106 @@ def main(argv):
     parser.add_argument("--version", action="version", version="fishnet v{0}".format(__version__))
 
     g = parser.add_argument_group("configuration")
-    g.add_argument("--auto-update", action="store_true", help="automatically install available updates")
+    g.add_argument("--auto-update", action="store_true",
+                   help="automatically install available updates")
     g.add_argument("--conf", help="configuration file")
     g.add_argument("--no-conf", action="store_true", help="do not use a configuration file")
     g.add_argument("--key", "--apikey", "-k", help="fishnet api key")
 
     g = parser.add_argument_group("resources")
-    g.add_argument("--cores", help="number of cores to use for engine processes (or auto for n - 1, or all for n)")
+    g.add_argument("--cores",
+                   help="number of cores to use for engine processes "
+                        "(or auto for n - 1, or all for n)")
     g.add_argument("--memory", help="total memory (MB) to use for engine hashtables")
+    g.add_argument("--large-pages", choices=["auto", "yes", "no"],
+                   help="use large pages for hashtables, if supported by the engine "
+                        "(default: auto, if hugepages are available)")
+    g.add_argument("--move-workers", type=int,
+                   help="number of cores to reserve for single threaded engines, "
+                        "that only play moves (default: 0)")
+    g.add_argument("--light-level", type=int,
+                   help="highest level that other engines leave to idle move engines "
+                        "(default: %d)" % LIGHT_LEVEL)
+    g.add_argument("--ponder", action="store_true", default=None,
+                   help="search the expected next position of played games while idle")
+    g.add_argument("--no-ponder", dest="ponder", action="store_false", default=None)
 
     g = parser.add_argument_group("advanced")
     g.add_argument("--endpoint", help="lichess http endpoint (default: %s)" % DEFAULT_ENDPOINT)
     g.add_argument("--socks5-host", type=str, help="use a SOCKS5 proxy (host or host:port)")
     g.add_argument("--engine-dir", help="engine working directory")
-    g.add_argument("--stockfish-command", help="stockfish command (default: download precompiled Stockfish)")
-    g.add_argument("--threads-per-process", "--threads", type=int, dest="threads", help="hint for the number of threads to use per engine process (default: 4)")
-    g.add_argument("--fixed-backoff", action="store_true", default=None, help="fixed backoff (only recommended for move servers)")
+    g.add_argument("--stockfish-command",
+                   help="stockfish command (default: download precompiled Stockfish)")
+    g.add_argument("--syzygy-path",
+                   help="directories with Syzygy tablebases (separated by %s)" % os.pathsep)
+    g.add_argument("--engine-cache",
+                   help="directory for downloaded engines, can be shared "
+                        "(default: %s in engine directory)" % ARTIFACT_CACHE)
+    g.add_argument("--engine-mirror",
+                   help="download engines from this URL or directory, with release.json as "
+                        "returned by the GitHub API")
+    g.add_argument("--threads-per-process", "--threads", type=int, dest="threads",
+                   help="hint for the number of threads to use per engine process (default: 4)")
+    g.add_argument("--fixed-backoff", action="store_true", default=None,
+                   help="fixed backoff (only recommended for move servers)")
     g.add_argument("--no-fixed-backoff", dest="fixed_backoff", action="store_false", default=None)
-    g.add_argument("--setoption", "-o", nargs=2, action="append", default=[], metavar=("NAME", "VALUE"), help="set a custom uci option")
+    g.add_argument("--load-control", action="store_true", default=None,
+                   help="park engines while the host is busy with other work")
+    g.add_argument("--no-load-control", dest="load_control", action="store_false", default=None)
+    g.add_argument("--long-poll", type=int, metavar="SECONDS",
+                   help="let the server hold acquire requests until a job is available "
+                        "(default: 0, disabled)")
+    g.add_argument("--coordinator", metavar="HOST:PORT",
+                   help="get jobs from a fishnet coordinator instead of the endpoint")
+    g.add_argument("--listen", default="127.0.0.1", metavar="HOST:PORT",
+                   help="address of the coordinator (default: 127.0.0.1:%d)" % COORDINATOR_PORT)
+    g.add_argument("--coordinator-token",
+                   help="secret shared by the coordinator and its agents "
+                        "(required unless listening on localhost)")
+    g.add_argument("--control-socket", metavar="PATH",
+                   help="unix socket to control a running client with fishnet ctl")
+    g.add_argument("--batch", type=int, default=DEFAULT_BATCH,
+                   help="maximum number of concurrent job requests of the coordinator "
+                        "(default: %d)" % DEFAULT_BATCH)
+    g.add_argument("--output", help="analysis output file (default: stdout)")
+    g.add_argument("--output-format", choices=["jsonl", "jsonl.gz", "packed", "parquet"],
+                   help="analysis output format (default: by file extension, or jsonl)")
+    g.add_argument("--setoption", "-o", nargs=2, action="append", default=[],
+                   metavar=("NAME", "VALUE"),
+                   help="set a custom uci option")
 
     commands = collections.OrderedDict([
         ("run", cmd_run),
+        ("analyse", cmd_analyse),
+        ("coordinator", cmd_coordinator),
+        ("ctl", cmd_ctl),
         ("configure", cmd_configure),
         ("systemd", cmd_systemd),
         ("cpuid", cmd_cpuid),
     ])
 
     parser.add_argument("command", default="run", nargs="?", choices=commands.keys())
+    parser.add_argument("file", nargs="?",
+                        help="games to analyse (PGN or JSONL, - for stdin), or ctl command: "
+                             "status, pause, resume, add, remove, resize or reload")
+    parser.add_argument("values", nargs="*", help=argparse.SUPPRESS)
 
     args = parser.parse_args(argv[1:])
 
+    # Arguments of specific commands
+    if args.command != "analyse" and (args.output or args.output_format):
+        parser.error("--output and --output-format are only supported by analyse")
+    if args.command not in ["analyse", "ctl"] and args.file:
+        parser.error("unrecognized arguments: %s" % " ".join([args.file] + args.values))
+    if args.command != "ctl" and args.values:
+        parser.error("unrecognized arguments: %s" % " ".join(args.values))
+
     # Setup logging
     setup_logging(args.verbose,
-                  sys.stderr if args.command == "systemd" else sys.stdout)
+                  sys.stderr if args.command in ["systemd", "analyse", "ctl"] else sys.stdout)
 
     # Show intro
-    if args.command not in ["systemd", "cpuid"]:
+    if args.command not in ["systemd", "cpuid", "analyse", "ctl"]:
         print(intro())
 
     # Configure SOCKS5
@@ -11,15 +11,109 @@ import unittest
 import logging
 import sys
 import multiprocessing
+import threading
+import json
+import time
+import tempfile
+import io
+import shutil
+import os
+import socket
+import stat
+import subprocess
 
 try:
     import configparser
 except ImportError:
     import ConfigParser as configparser
 
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+try:
+    import chess
+except ImportError:
+    chess = None
+
 
 STARTPOS = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
+# Engine build that always searches at the given speed
+MOCK_BUILD = """#!%s
+import sys
+for line in iter(sys.stdin.readline, ""):
+    if line.startswith("uci"):
+        print("uciok")
+    elif line.startswith("isready"):
+        print("readyok")
+    elif line.startswith("go"):
+        print("info depth 10 nodes %d nps %d time 1000")
+        print("bestmove e2e4")
+    sys.stdout.flush()
+"""
+
+# UCI engine with fake searches. Searches with a long movetime only end
+# when stopped.
+MOCK_ENGINE = """#!PYTHON
+import sys
+options = {"MultiPV": "1", "Threads": "1", "Hash": "16"}
+pending = False
+for line in iter(sys.stdin.readline, ""):
+    tokens = line.split()
+    if not tokens:
+        continue
+    elif tokens[0] == "uci":
+        print("id name Mockfish")
+        for name in ["Threads", "Hash", "MultiPV", "UCI_Chess960", "UCI_Variant", "Skill Level",
+                     "SyzygyPath"]:
+            print("option name " + name + " type string default")
+        print("uciok")
+    elif tokens[0] == "isready":
+        print("readyok")
+    elif tokens[0] == "setoption":
+        options[tokens[2]] = " ".join(tokens[4:])
+    elif tokens[0] == "go":
+        nodes = tokens[tokens.index("nodes") + 1] if "nodes" in tokens else "1000"
+        if "movetime" in tokens and int(tokens[tokens.index("movetime") + 1]) >= 10000:
+            pending = True
+            continue
+        print("info depth 1 currmove e2e4 currmovenumber 1")
+        print("info string threads " + options["Threads"] + " hash " + options["Hash"])
+        for i in range(1, int(options["MultiPV"]) + 1):
+            print("info depth 10 seldepth 12 multipv " + str(i) + " score cp " + str(10 * i) +
+                  " nodes " + nodes + " nps 1000000 time 200 pv e2e4 e7e5")
+        print("bestmove e2e4 ponder e7e5")
+    elif tokens[0] == "stop" and pending:
+        pending = False
+        print("bestmove e2e4 ponder e7e5")
+    elif tokens[0] == "quit":
+        break
+    sys.stdout.flush()
+"""
+
+
+def mock_engine_conf(tmpdir):
+    path = os.path.join(tmpdir, "mockfish")
+    with open(path, "w") as f:
+        f.write(MOCK_ENGINE.replace("PYTHON", sys.executable))
+    os.chmod(path, 0o755)
+
+    conf = configparser.ConfigParser()
+    conf.add_section("Fishnet")
+    conf.set("Fishnet", "Key", "testkey")
+    conf.set("Fishnet", "EngineDir", tmpdir)
+    conf.set("Fishnet", "StockfishCommand", "./mockfish")
+    return conf
+
 
 class WorkerTest(unittest.TestCase):
 
@@ -27,6 +121,8 @@ class WorkerTest(unittest.TestCase):
         conf = configparser.ConfigParser()
         conf.add_section("Fishnet")
         conf.set("Fishnet", "Key", "testkey")
+        self.tmpdir = tempfile.mkdtemp()
+        conf.set("Fishnet", "EngineDir", self.tmpdir)
 
         fishnet.get_stockfish_command(conf, update=True)
 
@@ -35,6 +131,7 @@ class WorkerTest(unittest.TestCase):
 
     def tearDown(self):
         fishnet.send(self.worker.stockfish, "quit")
+        shutil.rmtree(self.tmpdir)
 
     def test_bestmove(self):
         job = {
@@ -76,6 +173,677 @@ class WorkerTest(unittest.TestCase):
         self.assertEqual(result[4]["score"]["mate"], 0)
 
 
+class QueueBroker(object):
+    # Job source for workers, answering each exchange with the next queued
+    # job, if any, or a reply prepared for the path. Results can be held
+    # back until the gate is opened.
+
+    def __init__(self, jobs=()):
+        self.jobs = list(jobs)
+        self.replies = {}
+        self.paths = []
+        self.aborted = []
+        self.lock = threading.Lock()
+        self.submitted = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def exchange(self, worker, path, request):
+        if path != "acquire":
+            self.submitted.set()
+            self.gate.wait(5.0)
+
+        with self.lock:
+            self.paths.append(path)
+            if path in self.replies:
+                return self.replies.pop(path)
+            return self.jobs.pop(0) if self.jobs else None
+
+    def abort(self, worker, job):
+        with self.lock:
+            self.aborted.append(job)
+
+    def progress(self, worker, job, result):
+        pass
+
+
+def move_job(job_id, game_id="hgfedcba", moves=""):
+    return {
+        "work": {"type": "move", "id": job_id, "level": 8},
+        "game_id": game_id,
+        "position": STARTPOS,
+        "moves": moves,
+    }
+
+
+class MockEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.conf = mock_engine_conf(self.tmpdir)
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            if worker.stockfish:
+                fishnet.kill_process(worker.stockfish)
+        shutil.rmtree(self.tmpdir)
+
+    def make_worker(self, governor=None, memory=16, **kwargs):
+        worker = fishnet.Worker(self.conf, 1, memory, governor, **kwargs)
+        worker.start_stockfish()
+        self.workers.append(worker)
+        return worker
+
+    def test_go_multipv(self):
+        p = self.make_worker().stockfish
+        fishnet.set_multipv(p, 3)
+        info = fishnet.go(p, STARTPOS, [], nodes=5000)
+
+        self.assertEqual(info["bestmove"], "e2e4")
+        self.assertEqual(info["ponder"], "e7e5")
+        self.assertEqual(info["score"], {"cp": 10})
+        self.assertEqual(info["nodes"], 5000)
+        self.assertNotIn("currmove", info)
+        self.assertEqual(info["pvs"], [
+            {"depth": 10, "score": {"cp": 10}, "pv": "e2e4 e7e5"},
+            {"depth": 10, "score": {"cp": 20}, "pv": "e2e4 e7e5"},
+            {"depth": 10, "score": {"cp": 30}, "pv": "e2e4 e7e5"},
+        ])
+
+    def test_hash_sized_once(self):
+        worker = self.make_worker(memory=256)
+        self.assertEqual(worker.hash, 256)
+
+        # Playing moves does not reallocate the hash of analysis engines
+        worker.bestmove({
+            "work": {"type": "move", "id": "abcdefgh", "level": 1},
+            "game_id": "hgfedcba",
+            "position": STARTPOS,
+            "moves": "e2e4",
+        })
+        self.assertEqual(worker.hash, 256)
+        self.assertEqual(worker.stockfish_info["options"]["hash"], "256")
+
+        # Only explicit resizes do
+        worker.request_resize(2, 128)
+        worker.apply_resize()
+        self.assertEqual(worker.hash, 128)
+        self.assertEqual(worker.stockfish_info["options"]["threads"], "2")
+
+        # Unless the hash is a custom option
+        self.conf.add_section("Stockfish")
+        self.conf.set("Stockfish", "Hash", "32")
+        worker.set_hash(64)
+        self.assertEqual(worker.hash, 128)
+
+    def test_tablebase_search(self):
+        worker = self.make_worker()
+        job = {
+            "work": {"type": "analysis", "id": "12345678", "nodes": 500000},
+            "game_id": "87654321",
+            "position": STARTPOS,
+            "moves": "e2e4 e7e5 g1f3",
+        }
+
+        class Tablebase(object):
+            def resolved_plies(self, job):
+                return set([1, 3])
+
+        # Resolved plies only need a short search
+        task = fishnet.AnalysisTask(job, worker.make_request(), tablebase=Tablebase())
+        result = worker.run_analysis(task)
+        self.assertEqual([ply["nodes"] for ply in result["analysis"]],
+                         [500000, fishnet.TABLEBASE_NODES, 500000, fishnet.TABLEBASE_NODES])
+
+    def test_ponder(self):
+        self.conf.set("Fishnet", "Ponder", "yes")
+        worker = self.make_worker()
+        job = {
+            "work": {"type": "move", "id": "abcdefgh", "level": 8},
+            "game_id": "hgfedcba",
+            "position": STARTPOS,
+            "moves": "",
+        }
+
+        # Expect the ponder move as the reply
+        worker.bestmove(job)
+        self.assertEqual(worker.ponder_next["moves"], ["e2e4", "e7e5"])
+
+        worker.start_ponder()
+        self.assertEqual(worker.pondering["game_id"], "hgfedcba")
+        self.assertEqual(worker.ponder_next, None)
+        worker.stop_ponder()
+        self.assertEqual(worker.pondering, None)
+        self.assertEqual(worker.ponder_searches, 1)
+
+        # The next move job of the game searches the pondered position
+        job["moves"] = "e2e4 e7e5"
+        worker.bestmove(job)
+        self.assertEqual(worker.ponder_hits, 1)
+
+    def test_ponder_error(self):
+        worker = self.make_worker()
+
+        def fetch(path, request):
+            raise fishnet.HttpServerError(500, "Internal Server Error", "")
+
+        def stop_ponder():
+            raise IOError("engine gone")
+
+        # Failing to stop pondering does not hide the error of the request
+        worker.fetch = fetch
+        worker.stop_ponder = stop_ponder
+        worker.sleep.set()
+        worker.run_inner()
+        self.assertEqual(worker.job, None)
+
+        # Handled as a server error, rather than a dead engine
+        worker.stockfish.poll()
+        self.assertEqual(worker.stockfish.returncode, None)
+
+    def test_analyse(self):
+        with open(os.path.join(self.tmpdir, "games.jsonl"), "w") as f:
+            f.write('{"game_id": "abcdefgh", "moves": "e2e4 e7e5"}\n')
+
+        # Move engines are not started, so they get no share of the memory
+        move_workers = "1" if multiprocessing.cpu_count() > 1 else "0"
+        process = subprocess.Popen([sys.executable, os.path.abspath(fishnet.__file__),
+                                    "--engine-dir", self.tmpdir,
+                                    "--stockfish-command", "./mockfish",
+                                    "--cores", "all", "--memory", "64",
+                                    "--move-workers", move_workers,
+                                    "analyse", "games.jsonl", "--output", "analysis.jsonl"],
+                                   cwd=self.tmpdir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+
+        self.conf.set("Fishnet", "Cores", "all")
+        self.conf.set("Fishnet", "Memory", "64")
+        layout, _ = fishnet.worker_layout(self.conf)
+        self.assertIn(("with %d engine processes" % len(layout)).encode("utf-8"), stderr)
+        self.assertIn(("%d MB)" % layout[0][1]).encode("utf-8"), stderr)
+
+        with open(os.path.join(self.tmpdir, "analysis.jsonl")) as f:
+            games = [json.loads(line) for line in f]
+        self.assertEqual(len(games), 1)
+        self.assertEqual(len(games[0]["analysis"]), 3)
+        self.assertFalse(any("ponder" in ply for ply in games[0]["analysis"]))
+
+    def test_startup_cache_hit(self):
+        options = fishnet.stockfish_options("./mockfish", self.conf)
+        self.assertIn("UCI_Variant", options)
+
+        # After a restart, the validation result is read from the cache
+        fishnet.STOCKFISH_OPTIONS.clear()
+        fishnet.STARTUP_CACHES.clear()
+        validations = fishnet.STARTUP_TIMINGS.get("engine validation")
+        self.assertEqual(fishnet.stockfish_options("./mockfish", self.conf), options)
+        self.assertEqual(fishnet.STARTUP_TIMINGS.get("engine validation"), validations)
+
+        # Until the binary changes
+        with open(os.path.join(self.tmpdir, "mockfish"), "a") as f:
+            f.write("\n")
+        os.utime(os.path.join(self.tmpdir, "mockfish"), (0, 0))
+        self.assertEqual(fishnet.stockfish_options("./mockfish", self.conf), options)
+        self.assertNotEqual(fishnet.STARTUP_TIMINGS.get("engine validation"), validations)
+
+    def test_retire_parked(self):
+        worker = self.make_worker(broker=QueueBroker())
+        worker.sleep.set()
+        worker.park()
+        worker.start()
+        time.sleep(0.2)
+
+        # Woken up to stop
+        worker.retire()
+        self.assertTrue(worker.finished.wait(5.0))
+        self.assertFalse(worker.is_alive())
+
+    def test_retire_busy(self):
+        next_job = move_job("ijklmnop")
+        broker = QueueBroker([next_job])
+        worker = self.make_worker(lane="move", broker=broker)
+        worker.job = move_job("abcdefgh")
+
+        # The current move is played, but the next job is given back
+        worker.retire()
+        worker.run_inner()
+        self.assertEqual(broker.paths, ["move/abcdefgh"])
+        self.assertEqual(broker.aborted, [next_job])
+        self.assertEqual(worker.job, None)
+
+        worker.run_inner()
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(broker.paths, ["move/abcdefgh"])
+
+    def test_handoff_before_resume(self):
+        governor = fishnet.Governor(self.conf)
+        worker = self.make_worker(governor)
+        job = {
+            "work": {"type": "analysis", "id": "12345678"},
+            "game_id": "87654321",
+            "position": STARTPOS,
+            "moves": "e2e4",
+        }
+        governor.suspend(fishnet.AnalysisTask(job, worker.make_request()))
+        governor.handoff(move_job("abcdefgh"), worker)
+
+        # Moves are played before suspended analysis is continued
+        self.assertEqual(worker.work()[0], "move/abcdefgh")
+        worker.job = None
+        self.assertEqual(worker.work()[0], "analysis/12345678")
+
+    def test_suspend_resume(self):
+        governor = fishnet.Governor(self.conf)
+        first = self.make_worker(governor)
+        second = self.make_worker(governor)
+        job = {
+            "work": {"type": "analysis", "id": "12345678"},
+            "game_id": "87654321",
+            "position": STARTPOS,
+            "moves": "e2e4 e7e5 g1f3",
+        }
+
+        # Suspend after the first ply
+        task = fishnet.AnalysisTask(job, first.make_request())
+        task.prepare(first.stockfish)
+        task.step(first.stockfish)
+        first.yield_requested.set()
+        self.assertEqual(first.run_analysis(task), None)
+        self.assertEqual(task.next_ply, 2)
+        governor.suspend(task)
+
+        # Overdue progress reports are claimed once
+        self.assertEqual(governor.overdue(-1.0), [task])
+        self.assertEqual(governor.overdue(60.0), [])
+
+        # Continue on another engine
+        second.stockfish_info["name"] = "Second"
+        path, result = second.work()
+        self.assertEqual(path, "analysis/12345678")
+        self.assertEqual(result["stockfish"]["name"], "Second")
+        self.assertTrue(all(ply["score"] == {"cp": 10} for ply in result["analysis"]))
+        self.assertFalse(any("ponder" in ply for ply in result["analysis"]))
+        self.assertEqual(second.positions, 3)
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    # Local stand-in for the fishnet API, handing out queued jobs
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeRequestHandler)
+        self.cond = threading.Condition()
+        self.jobs = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def endpoint(self):
+        return "http://127.0.0.1:%d/fishnet/" % self.server_address[1]
+
+    def put(self, job):
+        with self.cond:
+            self.jobs.append(job)
+            self.cond.notify_all()
+
+    def take(self, wait):
+        deadline = time.time() + wait
+        with self.cond:
+            while not self.jobs and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            return self.jobs.pop(0) if self.jobs else None
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        url_info = urlparse.urlparse(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if url_info.path == "/fishnet/acquire":
+            query = urlparse.parse_qs(url_info.query)
+            job = self.server.take(float(query.get("wait", [0])[0]))
+        else:
+            job = None
+
+        if job is None:
+            self.send_response(204)
+            self.end_headers()
+        else:
+            body = json.dumps(job).encode("utf-8")
+            self.send_response(202)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LongPollTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_long_poll(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Endpoint", self.server.endpoint())
+        conf.set("Fishnet", "LongPoll", "10")
+        worker = fishnet.Worker(conf, 1, 16)
+
+        result = {}
+
+        def acquire():
+            result["job"] = worker.fetch("acquire", worker.make_request())
+            result["time"] = time.time()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        time.sleep(0.5)
+
+        job = {
+            "work": {
+                "type": "move",
+                "id": "abcdefgh",
+                "level": 1,
+            },
+            "game_id": "hgfedcba",
+            "position": STARTPOS,
+            "moves": "",
+        }
+        queued = time.time()
+        self.server.put(job)
+        thread.join(5.0)
+
+        self.assertEqual(result["job"], job)
+        self.assertTrue(result["time"] - queued < 0.5)
+
+
+class CoordinatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Endpoint", self.server.endpoint())
+        conf.set("Fishnet", "Key", "testkey")
+        conf.set("Fishnet", "LongPoll", "10")
+        self.coordinator = fishnet.Coordinator(conf, fishnet.load_settings(conf), 2, "secret")
+        self.coordinator_server = fishnet.CoordinatorServer(("127.0.0.1", 0), self.coordinator)
+        thread = threading.Thread(target=self.coordinator_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.coordinator.start()
+
+    def tearDown(self):
+        self.coordinator_server.shutdown()
+        self.coordinator_server.server_close()
+        self.coordinator.stop()
+        self.server.stop()
+
+    def test_coordinator(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Coordinator",
+                 "127.0.0.1:%d" % self.coordinator_server.server_address[1])
+        conf.set("Fishnet", "CoordinatorToken", "secret")
+        broker = fishnet.CoordinatorBroker(fishnet.get_coordinator(conf),
+                                           fishnet.get_coordinator_token(conf))
+        worker = fishnet.Worker(conf, 1, 16, broker=broker)
+        worker.name = "agent"
+        worker.positions = 7
+
+        job = {
+            "work": {
+                "type": "move",
+                "id": "abcdefgh",
+                "level": 1,
+            },
+            "game_id": "hgfedcba",
+            "position": STARTPOS,
+            "moves": "",
+        }
+        self.server.put(job)
+
+        self.assertEqual(worker.fetch("acquire", worker.make_request()), job)
+
+        active, positions, _, buffered = self.coordinator.stats()
+        self.assertEqual(active, 1)
+        self.assertEqual(positions, 7)
+        self.assertEqual(buffered, 0)
+
+    def test_rejected_requests(self):
+        reply = self.coordinator.handle({"path": "acquire", "token": "wrong"})
+        self.assertEqual(reply["status"], 401)
+
+        for path in ["key/testkey", "analysis/../key", "acquire?slow=true", "move/abc/def"]:
+            reply = self.coordinator.handle({"path": path, "token": "secret"})
+            self.assertEqual(reply["status"], 403, path)
+
+        reply = self.coordinator.handle({"path": "acquire", "lane": "other", "token": "secret"})
+        self.assertEqual(reply["status"], 403)
+
+
+@unittest.skipIf(not hasattr(socket, "AF_UNIX"), "requires unix domain sockets")
+class ControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "fishnet.sock")
+
+        conf = mock_engine_conf(self.tmpdir)
+        self.broker = QueueBroker()
+        self.pool = fishnet.WorkerPool(None, conf, fishnet.load_settings(conf), self.broker)
+        self.server = fishnet.ControlServer(self.path, self.pool)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.broker.gate.set()
+        for worker in self.pool.running():
+            worker.stop()
+        for worker in self.pool.running():
+            worker.finished.wait(5.0)
+        shutil.rmtree(self.tmpdir)
+
+    def send(self, command, *args):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(json.dumps({"command": command, "args": args}).encode("utf-8") + b"\n")
+            return json.loads(sock.makefile("rb").readline().decode("utf-8"))
+        finally:
+            sock.close()
+
+    def status(self, number):
+        return self.send("status")["workers"][number - 1]
+
+    def wait_for(self, number, **expected):
+        deadline = time.time() + 10.0
+        while time.time() < deadline:
+            status = self.status(number)
+            if all(status[key] == value for key, value in expected.items()):
+                return status
+            time.sleep(0.05)
+        self.fail("Worker %d is not %r: %r" % (number, expected, status))
+
+    def test_control(self):
+        self.assertEqual(self.send("status"), {"workers": []})
+        self.assertEqual(self.send("resize", "1", "1"), {"error": "No such worker: 1"})
+        self.assertIn("error", self.send("remove"))
+        self.assertIn("error", self.send("unknown"))
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode) & 0o077, 0)
+
+    def test_ctl_without_config(self):
+        # Run in a directory without fishnet.ini, with nothing to answer
+        # prompts
+        with open(os.devnull) as devnull:
+            process = subprocess.Popen([sys.executable, os.path.abspath(fishnet.__file__),
+                                        "--control-socket", self.path, "ctl", "status"],
+                                       cwd=self.tmpdir, stdin=devnull,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
+
+        self.assertEqual(process.returncode, 0, stderr)
+        self.assertTrue(stdout.startswith(b"worker"), stdout)
+
+    def test_socket_in_use(self):
+        with self.assertRaises(fishnet.ConfigError):
+            fishnet.ControlServer(self.path, self.pool)
+
+        # Stale sockets are replaced
+        self.server.shutdown()
+        self.server.socket.close()
+        self.server = fishnet.ControlServer(self.path, self.pool)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.assertEqual(self.send("status"), {"workers": []})
+
+    def test_pause_resume(self):
+        self.assertEqual(self.send("add", "1", "16"), {"message": "Added ><> 1"})
+        self.wait_for(1, state="idle")
+
+        self.assertEqual(self.send("pause"), {"message": "Paused 1 workers"})
+        self.wait_for(1, state="paused")
+        self.assertFalse(self.pool.find(1).active.is_set())
+
+        self.assertEqual(self.send("resume", "1"), {"message": "Resumed 1 workers"})
+        self.wait_for(1, state="idle")
+
+    def test_remove(self):
+        # Hold back the result of the first worker
+        self.broker.jobs.append(move_job("abcdefgh"))
+        self.broker.replies["move/abcdefgh"] = move_job("ijklmnop")
+        self.broker.gate.clear()
+        self.assertEqual(self.send("add", "1", "16"), {"message": "Added ><> 1"})
+        self.assertTrue(self.broker.submitted.wait(10.0))
+
+        # The last worker of a lane is kept
+        self.assertEqual(self.send("add", "move"), {"message": "Added ><> 2 (move)"})
+        self.assertEqual(self.send("remove", "1"),
+                         {"error": "Can not remove the last analysis worker"})
+        self.assertEqual(self.send("remove", "2"), {"error": "Can not remove the last move worker"})
+
+        # Retired at the job boundary, after the result is submitted. The
+        # next job is left to others.
+        self.send("add", "1", "16")
+        self.assertEqual(self.send("remove", "1"),
+                         {"message": "Retiring 1 workers at the next job boundary"})
+        self.assertEqual(self.status(1)["state"], "retiring")
+        self.broker.gate.set()
+        self.wait_for(1, state="stopped")
+
+        self.assertEqual(self.pool.workers[1].moves, 1)
+        self.assertIn("move/abcdefgh", self.broker.paths)
+        self.assertEqual(self.send("resize", "1", "1"), {"error": "No such worker: 1"})
+
+    def test_resize(self):
+        self.send("add", "1", "16")
+        self.wait_for(1, state="idle", hash=16)
+
+        self.assertEqual(self.send("resize", "1", "1", "32"),
+                         {"message": "Resizing ><> 1 at the next job boundary"})
+        self.wait_for(1, hash=32, resize=None)
+        self.assertIn("error", self.send("resize", "1", "1", "8"))
+
+    def test_reload(self):
+        path = os.path.join(self.tmpdir, "fishnet.ini")
+        with open(path, "w") as f:
+            f.write("[Fishnet]\nKey = testkey\nEngineDir = %s\nStockfishCommand = ./mockfish\n"
+                    "Cores = 1\nThreads = 1\nMemory = 32\n" % self.tmpdir)
+        self.pool.args = argparse.Namespace(conf=path, no_conf=False, setoption=[])
+
+        for _ in range(2):
+            self.send("add", "1", "16")
+        self.send("add", "move")
+
+        # Scaled to a single analysis worker. The move worker is kept.
+        self.assertEqual(self.send("reload"), {"message": "Reloaded configuration"})
+        self.wait_for(1, hash=32, resize=None)
+        self.wait_for(2, state="stopped")
+        self.wait_for(3, state="idle")
+        self.assertEqual(self.pool.settings.key, "testkey")
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    data = b"0123456789" * 1000
+    ranges = []
+
+    def do_GET(self):
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.ranges.append(start)
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(self.data) - start))
+        self.end_headers()
+        self.wfile.write(self.data[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_download(self):
+        path = os.path.join(self.tmpdir, "stockfish.part")
+        with open(path, "wb") as f:
+            f.write(RangeRequestHandler.data[:4000])
+
+        url = "http://127.0.0.1:%d/stockfish" % self.server.server_address[1]
+        fishnet.download(url, path, len(RangeRequestHandler.data))
+
+        self.assertEqual(RangeRequestHandler.ranges, [4000])
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), RangeRequestHandler.data)
+
+    def test_release_lookup_failed(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "EngineDir", self.tmpdir)
+        conf.set("Fishnet", "EngineMirror", self.tmpdir)
+        filenames = ["stockfish-x86-64-bmi2", "stockfish-x86-64"]
+
+        # No release.json in the mirror and nothing installed
+        self.assertRaises(IOError, fishnet.download_github_release,
+                          conf, fishnet.STOCKFISH_RELEASES, filenames)
+
+        # Use the installed builds only
+        open(os.path.join(self.tmpdir, "stockfish-x86-64"), "w").close()
+        self.assertEqual(fishnet.download_github_release(conf, fishnet.STOCKFISH_RELEASES,
+                                                         filenames),
+                         ["stockfish-x86-64"])
+
+
 class UnitTests(unittest.TestCase):
 
     def test_parse_bool(self):
@@ -84,6 +852,436 @@ class UnitTests(unittest.TestCase):
         self.assertEqual(fishnet.parse_bool(""), False)
         self.assertEqual(fishnet.parse_bool("", default=True), True)
 
+    def test_analysis_profile(self):
+        job = {"work": {"type": "analysis", "id": "12345678", "multipv": 3}}
+        profile = fishnet.analysis_profile(job, {"depth": 20, "nodes": None})
+        self.assertEqual(profile["multipv"], 3)
+        self.assertEqual(profile["depth"], 20)
+        self.assertEqual(profile["nodes"], None)
+        self.assertEqual(profile["movetime"], 4000)
+
+        # Job values are checked like the config
+        job["work"].update(multipv=500, depth=-1, movetime="x")
+        profile = fishnet.analysis_profile(job)
+        self.assertEqual(profile["multipv"], fishnet.MAX_MULTIPV)
+        self.assertEqual(profile["depth"], None)
+        self.assertEqual(profile["movetime"], 4000)
+
+        conf = configparser.ConfigParser()
+        conf.add_section("Analysis")
+        conf.set("Analysis", "nodes", "none")
+        conf.set("Analysis", "movetime", "none")
+        self.assertRaises(fishnet.ConfigError, fishnet.validate_analysis_profile, conf, True)
+        conf.set("Analysis", "depth", "20")
+        self.assertEqual(fishnet.validate_analysis_profile(conf, True),
+                         {"nodes": None, "movetime": None, "depth": 20})
+
+    def test_read_jobs(self):
+        f = io.StringIO(u'{"game_id": "abcdefgh", "moves": "e2e4 e7e5"}\n\n')
+        jobs = list(fishnet.read_jobs(f, "games.jsonl"))
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]["work"]["type"], "analysis")
+        self.assertEqual(jobs[0]["game_id"], "abcdefgh")
+        self.assertEqual(jobs[0]["position"], STARTPOS)
+
+        # Invalid lines do not end the stream
+        f = io.StringIO(u'{"game_id": "abcdefgh"\n'
+                        u'{"game_id": "abcdefgh"}\n'
+                        u'{"work": {"type": "move", "id": "abcdefgh"}, "moves": ""}\n'
+                        u'{"game_id": "hgfedcba", "moves": "e2e4"}\n')
+        jobs = list(fishnet.read_jobs(f, "games.jsonl"))
+        self.assertEqual(jobs[:3], [None, None, None])
+        self.assertEqual(jobs[3]["game_id"], "hgfedcba")
+
+        broker = fishnet.BatchBroker(iter(jobs), None)
+        self.assertEqual(broker.exchange(None, "acquire", {}), jobs[3])
+        self.assertEqual(broker.failed, 3)
+
+    def test_packed_sink(self):
+        f = io.BytesIO()
+        job = {"work": {"type": "analysis", "id": "12345678"}, "game_id": "abcdefgh"}
+        result = {"analysis": [{"depth": 20, "score": {"cp": -24}, "pv": "e7e5"},
+                               {"depth": 0, "score": {"mate": 0}}]}
+        fishnet.PackedSink(f).write(job, result)
+
+        data = f.getvalue()
+        magic, plies = fishnet.PackedSink.GAME.unpack_from(data)
+        self.assertEqual(magic, b"FNG1")
+        self.assertEqual(plies, 2)
+
+        offset = fishnet.PackedSink.GAME.size + 2 + 8 + 2 + 8
+        ply = fishnet.PackedSink.PLY.unpack_from(data, offset)
+        self.assertEqual(ply[1], 20)
+        self.assertEqual(ply[-2:], (1, -24))
+
+    def test_line_reader(self):
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        os.write(w, b"info depth 1 currmove e2e4 currmovenumber 1\ninfo string currmove e2e4\nbest")
+        os.write(w, b"move e2e4\npartial")
+        os.close(w)
+
+        class Pipe(object):
+            def fileno(self):
+                return r
+
+        class Process(object):
+            reader = fishnet.LineReader(Pipe())
+
+        p = Process()
+        self.assertEqual(fishnet.recv_quiet(p, fishnet.CURRMOVE), "info string currmove e2e4")
+        self.assertEqual(fishnet.recv_quiet(p, fishnet.CURRMOVE), "bestmove e2e4")
+        self.assertEqual(fishnet.recv_quiet(p), "partial")
+        self.assertRaises(EOFError, fishnet.recv_quiet, p)
+
+    def test_encode_move(self):
+        for uci in ["e2e4", "a7a8q", "h2h1n", "P@e4", "e1h1", "0000"]:
+            self.assertEqual(fishnet.decode_move(fishnet.encode_move(uci)), uci)
+
+    def test_ply_info(self):
+        part = {"depth": 18, "score": {"mate": -3}, "pv": "e7e5 g1f3", "bestmove": "e7e5",
+                "string": "x"}
+        self.assertEqual(fishnet.PlyInfo.from_info(part).to_json(), part)
+
+    def test_validate_address(self):
+        self.assertEqual(fishnet.validate_address(""), None)
+        self.assertEqual(fishnet.validate_address("10.0.0.1:1234"), ("10.0.0.1", 1234))
+        self.assertEqual(fishnet.validate_address("fleet"), ("fleet", fishnet.COORDINATOR_PORT))
+        self.assertEqual(fishnet.validate_address("[::1]:1234"), ("::1", 1234))
+        self.assertEqual(fishnet.validate_address("[::1]"), ("::1", fishnet.COORDINATOR_PORT))
+        self.assertEqual(fishnet.validate_address("fe80::1"), ("fe80::1", fishnet.COORDINATOR_PORT))
+        self.assertEqual(fishnet.format_address(("fe80::1", 1234)), "[fe80::1]:1234")
+        self.assertRaises(fishnet.ConfigError, fishnet.validate_address, "[::1]1234")
+        self.assertRaises(fishnet.ConfigError, fishnet.validate_address, "fleet:http")
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(fishnet.percentile(values, 50), 50)
+        self.assertEqual(fishnet.percentile(values, 99), 99)
+        self.assertEqual(fishnet.percentile([0.5], 90), 0.5)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(fishnet.parse_retry_after("120"), 120.0)
+        self.assertEqual(fishnet.parse_retry_after(None), None)
+        self.assertEqual(fishnet.parse_retry_after("garbage"), None)
+        self.assertEqual(fishnet.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    def test_startup_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, fishnet.STARTUP_CACHE)
+            cache = fishnet.StartupCache(path)
+            self.assertEqual(cache.get("cpu", "model"), None)
+            cache.set("cpu", "model", [True, False])
+
+            cache = fishnet.StartupCache(path)
+            self.assertEqual(cache.get("cpu", "model"), [True, False])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def make_cgroup_tree(self, files):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        for name, content in files.items():
+            path = os.path.join(tmpdir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write(content)
+        return os.path.join(tmpdir, "cgroup"), os.path.join(tmpdir, "proc_cgroup")
+
+    def test_cgroup_v2(self):
+        root, proc_cgroup = self.make_cgroup_tree({
+            "proc_cgroup": "0::/system.slice/fishnet.service\n",
+            "cgroup/cgroup.controllers": "cpuset cpu memory\n",
+            "cgroup/cpu.max": "max 100000\n",
+            "cgroup/system.slice/cpu.max": "400000 100000\n",
+            "cgroup/system.slice/fishnet.service/cpu.max": "250000 100000\n",
+            "cgroup/system.slice/fishnet.service/cpuset.cpus.effective": "0-3,6\n",
+            "cgroup/system.slice/fishnet.service/memory.max": "2147483648\n",
+        })
+        self.assertEqual(fishnet.cgroup_cpus(root, proc_cgroup), 2)
+        self.assertEqual(fishnet.memory_limit(root, proc_cgroup), 2048)
+
+    def test_cgroup_v1(self):
+        root, proc_cgroup = self.make_cgroup_tree({
+            "proc_cgroup": ("4:memory:/docker/abc\n3:cpu,cpuacct:/docker/abc\n"
+                            "2:cpuset:/docker/abc\n"),
+            "cgroup/cpu,cpuacct/cpu.cfs_quota_us": "-1\n",
+            "cgroup/cpu,cpuacct/cpu.cfs_period_us": "100000\n",
+            "cgroup/cpuset/cpuset.cpus": "0-2\n",
+            "cgroup/memory/memory.limit_in_bytes": "9223372036854771712\n",
+        })
+        self.assertEqual(fishnet.cgroup_cpus(root, proc_cgroup), 3)
+        self.assertEqual(fishnet.memory_limit(root, proc_cgroup), None)
+
+    def test_validate_resize(self):
+        self.assertEqual(fishnet.validate_resize(["1"], 64), (1, 64))
+        self.assertEqual(fishnet.validate_resize(["1", "32"]), (1, 32))
+        with self.assertRaises(fishnet.ConfigError):
+            fishnet.validate_resize(["1", "8"])
+        with self.assertRaises(fishnet.ConfigError):
+            fishnet.validate_resize(["0"])
+
+    def test_large_pages(self):
+        self.assertTrue(fishnet.validate_large_pages("yes"))
+        self.assertFalse(fishnet.validate_large_pages("no"))
+        self.assertEqual(fishnet.validate_large_pages("auto"), fishnet.hugepages_available())
+
+    @unittest.skipIf(os.name == "nt", "large pages are always tried on Windows")
+    def test_hugepages_available(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            meminfo = os.path.join(tmpdir, "meminfo")
+            thp = os.path.join(tmpdir, "enabled")
+            missing = os.path.join(tmpdir, "missing")
+
+            with open(meminfo, "w") as f:
+                f.write("MemTotal:       16318412 kB\nHugePages_Free:        0\n")
+            with open(thp, "w") as f:
+                f.write("always madvise [never]\n")
+            self.assertFalse(fishnet.hugepages_available(meminfo, thp))
+            self.assertFalse(fishnet.hugepages_available(missing, missing))
+
+            with open(thp, "w") as f:
+                f.write("always [madvise] never\n")
+            self.assertTrue(fishnet.hugepages_available(meminfo, thp))
+
+            with open(meminfo, "w") as f:
+                f.write("HugePages_Free:       12\n")
+            self.assertTrue(fishnet.hugepages_available(meminfo, missing))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_syzygy_path(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        for name in ["KQvK.rtbw", "KQvK.rtbz", "KRPvKR.rtbw", "README"]:
+            open(os.path.join(tmpdir, name), "w").close()
+
+        self.assertEqual(fishnet.syzygy_pieces(tmpdir), 5)
+        self.assertEqual(fishnet.validate_syzygy_path(" "), None)
+        self.assertEqual(fishnet.validate_syzygy_path(tmpdir + os.pathsep), tmpdir)
+        with self.assertRaises(fishnet.ConfigError):
+            fishnet.validate_syzygy_path(os.path.join(tmpdir, "missing"))
+
+    @unittest.skipIf(chess is None, "requires python-chess")
+    def test_resolved_plies(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        tablebase = fishnet.Tablebase(tmpdir)
+        tablebase.tables.close()
+
+        class Tables(object):
+            def probe_wdl(self, board):
+                return 2
+
+            def close(self):
+                pass
+
+        # Pretend to have all 3 piece tables
+        tablebase.tables = Tables()
+        tablebase.pieces = 3
+
+        job = {"position": "4k3/8/8/8/8/8/8/R3K2Q w - - 0 1", "moves": "a1a2"}
+        self.assertEqual(tablebase.resolved_plies(job), set())
+
+        # Stops at an illegal move
+        job = {"position": "4k3/8/8/8/8/8/8/4K2Q w - - 0 1", "moves": "h1h8 e8d7 a1a2 d7c7"}
+        self.assertEqual(tablebase.resolved_plies(job), set([0, 1, 2]))
+        self.assertEqual(tablebase.resolved_plies({"position": "invalid", "moves": ""}), set())
+
+        # Closed only after probing in progress
+        probing, release = threading.Event(), threading.Event()
+
+        class SlowTables(Tables):
+            closed = False
+
+            def probe_wdl(self, board):
+                probing.set()
+                release.wait(5.0)
+                return 2
+
+            def close(self):
+                self.closed = True
+
+        tablebase.tables = SlowTables()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(tablebase.resolved_plies(job)))
+        thread.start()
+        self.assertTrue(probing.wait(5.0))
+        closing = threading.Thread(target=tablebase.close)
+        closing.start()
+        closing.join(0.2)
+        self.assertFalse(tablebase.tables.closed)
+
+        release.set()
+        thread.join(5.0)
+        closing.join(5.0)
+        self.assertEqual(results, [set([0, 1, 2])])
+        self.assertTrue(tablebase.tables.closed)
+        self.assertEqual(tablebase.resolved_plies(job), set())
+
+    def test_load_control(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, "pressure"))
+
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Key", "testkey")
+        workers = [fishnet.Worker(conf, 1, 16) for _ in range(3)]
+        controller = fishnet.LoadController(list(workers), tmpdir)
+
+        def control(pressure):
+            with open(os.path.join(tmpdir, "pressure", "cpu"), "w") as f:
+                f.write("some avg10=%0.2f avg60=0.00 avg300=0.00 total=0\n" % pressure)
+            controller.control()
+            return sum(1 for worker in workers if worker.active.is_set())
+
+        self.assertEqual(control(60.0), 2)
+        self.assertEqual(control(60.0), 1)
+        self.assertEqual(control(60.0), 1)
+        self.assertEqual(control(10.0), 1)
+        self.assertEqual(control(1.0), 2)
+        self.assertEqual((controller.parks, controller.resumes), (2, 1))
+
+        # Paused workers are not resumed by the controller
+        pool = fishnet.WorkerPool(None, conf, None)
+        pool.controller = controller
+        pool.workers.update(enumerate(workers, 1))
+        pool.pause(workers[0])
+        self.assertEqual(control(1.0), 2)
+        self.assertEqual(control(1.0), 2)
+        self.assertFalse(workers[0].active.is_set())
+        self.assertEqual(pool.status()[0]["state"], "paused")
+
+        pool.resume(workers[0])
+        self.assertEqual(control(1.0), 3)
+        self.assertIn(workers[0], controller.workers)
+
+    def test_select_fastest_build(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for filename, nps in [("stockfish-bmi2", 1000), ("stockfish-modern", 2000)]:
+                path = os.path.join(tmpdir, filename)
+                with open(path, "w") as f:
+                    f.write(MOCK_BUILD % (sys.executable, nps, nps))
+                os.chmod(path, 0o755)
+
+            conf = configparser.ConfigParser()
+            conf.add_section("Fishnet")
+            conf.set("Fishnet", "EngineDir", tmpdir)
+            candidates = ["stockfish-bmi2", "stockfish-modern", "stockfish"]
+            self.assertEqual(fishnet.stockfish_filename(conf, candidates), "stockfish-modern")
+
+            cache = fishnet.StartupCache(os.path.join(tmpdir, fishnet.STARTUP_CACHE))
+            selection = list(cache.data["build"].values())[0]
+            self.assertEqual(selection["nps"], {"stockfish-bmi2": 1000, "stockfish-modern": 2000})
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_governor_single_poller(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        governor = fishnet.Governor(conf)
+        poller = fishnet.Worker(conf, 1, 16, governor)
+        waiter = fishnet.Worker(conf, 1, 16, governor)
+
+        # The first idle worker becomes the poller
+        poller.sleep.set()
+        governor.no_job(poller)
+        self.assertIs(governor.poller, poller)
+
+        # Other idle workers wait until a job is found
+        thread = threading.Thread(target=governor.no_job, args=(waiter, ))
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+
+        governor.got_job(poller)
+        thread.join(5.0)
+        self.assertFalse(thread.is_alive())
+
+    def test_governor_handoff(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Key", "testkey")
+        governor = fishnet.Governor(conf)
+        poller = fishnet.Worker(conf, 1, 16, governor)
+        waiter = fishnet.Worker(conf, 1, 16, governor)
+        job = {"work": {"type": "move", "id": "abcdefgh", "level": 1}}
+
+        # Without idle workers, jobs are not handed off
+        self.assertFalse(governor.handoff(job))
+
+        # The poller backs off, while the other idle worker waits for it
+        governor.not_before = time.time() + 60
+        threads = [threading.Thread(target=governor.no_job, args=(worker, ))
+                   for worker in [poller, waiter]]
+        for thread in threads:
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+
+        # Both are idle. The sleeping poller is woken up.
+        other = {"work": {"type": "move", "id": "hgfedcba", "level": 1}}
+        self.assertTrue(governor.handoff(job))
+        self.assertTrue(governor.handoff(other))
+        self.assertFalse(governor.handoff(job))
+        for thread in threads:
+            thread.join(5.0)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(governor.take_handoff(waiter), job)
+        self.assertEqual(governor.take_handoff(poller), other)
+
+    def test_move_lane_aborts_analysis(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Key", "testkey")
+
+        class Broker(object):
+            aborted = []
+
+            def abort(self, worker, job):
+                self.aborted.append(job)
+
+        worker = fishnet.Worker(conf, 1, 16, lane="move", broker=Broker())
+        worker.sleep.set()
+        job = {"work": {"type": "analysis", "id": "12345678"}, "moves": "e2e4"}
+        worker.job = job
+
+        self.assertEqual(worker.work()[0], "acquire")
+        self.assertEqual(worker.job, None)
+        self.assertEqual(Broker.aborted, [job])
+
+    def test_governor_route(self):
+        conf = configparser.ConfigParser()
+        conf.add_section("Fishnet")
+        conf.set("Fishnet", "Key", "testkey")
+        governor = fishnet.Governor(conf)
+        worker = fishnet.Worker(conf, 1, 16, governor)
+        waiters = [fishnet.Worker(conf, 1, 16, governor) for _ in range(2)]
+        waiters[1].last_game = "hgfedcba"
+        job = {"work": {"type": "move", "id": "abcdefgh", "level": 1}, "game_id": "hgfedcba"}
+
+        worker.sleep.set()
+        governor.no_job(worker)
+        threads = [threading.Thread(target=governor.no_job, args=(waiter, )) for waiter in waiters]
+        for thread in threads:
+            thread.start()
+            thread.join(0.2)
+
+        # The worker that played the previous move of the game gets the job
+        self.assertTrue(governor.route(job, worker))
+        threads[1].join(5.0)
+        self.assertFalse(threads[1].is_alive())
+        self.assertEqual(governor.take_handoff(waiters[1]), job)
+        self.assertEqual(governor.routed["game"], 1)
+
+        governor.got_job(worker)
+        threads[0].join(5.0)
+
 
 if __name__ == "__main__":
     if "-v" in sys.argv or "--verbose" in sys.argv: